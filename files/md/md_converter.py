@@ -4,48 +4,59 @@
 Поддерживает Mermaid диаграммы и подсветку синтаксиса кода
 """
 
+import os
 import re
 import sys
+import glob
 import base64
+import contextlib
+import json
+import hashlib
+import functools
+import importlib
+import time
 import tempfile
+import threading
 import subprocess
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
 from enum import Enum
 
-# Установка зависимостей при необходимости
-try:
-    import requests
-    import markdown
-    from bs4 import BeautifulSoup
-    from playwright.sync_api import sync_playwright
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name, guess_lexer
-    from pygments.formatters import HtmlFormatter
-    from pygments.styles import get_style_by_name, get_all_styles
-except ImportError:
-    print("Установка необходимых библиотек...")
-    subprocess.check_call(
-        [
-            sys.executable,
-            "-m",
-            "pip",
-            "install",
-            "markdown",
-            "beautifulsoup4",
-            "playwright",
-            "requests",
-            "pygments",
-        ]
-    )
-    import requests
-    import markdown
-    from bs4 import BeautifulSoup
-    from playwright.sync_api import sync_playwright
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name, guess_lexer
-    from pygments.formatters import HtmlFormatter
-    from pygments.styles import get_style_by_name, get_all_styles
+
+class MissingDependencyError(ImportError):
+    """Не установлена библиотека, необходимая для выбранного режима работы"""
+
+
+def _require(module: str, package: str, purpose: str):
+    """
+    Импортирует необязательную зависимость в момент, когда она понадобилась
+
+    Тяжёлые библиотеки (markdown, pygments, requests, playwright) не
+    загружаются при импорте модуля, чтобы дешёвые режимы (--help,
+    --list-styles) запускались быстро, а каждый режим требовал только
+    действительно нужные ему пакеты.
+
+    Raises:
+        MissingDependencyError: если пакет не установлен
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise MissingDependencyError(
+            f"Для {purpose} требуется пакет '{package}': pip install {package}"
+        ) from e
 
 
 class OutputFormat(Enum):
@@ -64,251 +75,1617 @@ class Theme(Enum):
     MINIMAL = "minimal"
 
 
-class UniversalMarkdownConverter:
-    """Универсальный конвертер Markdown в различные форматы"""
+def default_cache_dir() -> Path:
+    """Каталог кэша по умолчанию (учитывает XDG_CACHE_HOME)"""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "md_converter"
 
-    # CSS темы оформления
-    THEMES = {
-        Theme.DEFAULT: """
-            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;700&display=swap');
-            @import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;500;600&display=swap');
-            
-            * { margin: 0; padding: 0; box-sizing: border-box; }
-            
-            body {
-                font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-                line-height: 1.7;
-                color: #2c3e50;
-                background: white;
-                padding: 40px;
-                max-width: 1200px;
-                margin: 0 auto;
-            }
-            
-            h1 {
-                color: #2c3e50;
-                font-size: 2.5em;
-                margin-bottom: 20px;
-                padding-bottom: 10px;
-                border-bottom: 3px solid #3498db;
-                page-break-after: avoid;
-            }
-            
-            h2 {
-                color: #34495e;
-                font-size: 2em;
-                margin-top: 40px;
-                margin-bottom: 20px;
-                padding-bottom: 8px;
-                border-bottom: 2px solid #ecf0f1;
-                page-break-after: avoid;
-            }
-            
-            h3 {
-                color: #34495e;
-                font-size: 1.5em;
-                margin-top: 30px;
-                margin-bottom: 15px;
-                page-break-after: avoid;
-            }
-            
-            p { margin-bottom: 15px; text-align: justify; }
-            ul, ol { margin-bottom: 20px; padding-left: 30px; }
-            li { margin-bottom: 8px; }
-            
-            code {
-                background: #f8f9fa;
-                padding: 2px 6px;
-                border-radius: 4px;
-                font-family: 'JetBrains Mono', 'Consolas', 'Monaco', monospace;
-                font-size: 0.9em;
-                color: #e74c3c;
-            }
-            
-            pre {
-                background: #2c3e50;
-                color: #ecf0f1;
-                padding: 20px;
-                border-radius: 8px;
-                overflow-x: auto;
-                margin: 20px 0;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                page-break-inside: avoid;
-                font-family: 'JetBrains Mono', 'Consolas', 'Monaco', monospace;
-                font-size: 0.9em;
-                line-height: 1.5;
-            }
-            
-            pre code {
-                background: none;
-                color: #ecf0f1;
-                padding: 0;
-            }
-            
-            .highlight {
-                border-radius: 8px;
-                margin: 20px 0;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                overflow: hidden;
-                page-break-inside: avoid;
-            }
-            
-            .highlight pre {
-                margin: 0 !important;
-                padding: 20px;
-                overflow-x: auto;
-                font-family: 'JetBrains Mono', 'Consolas', 'Monaco', monospace;
-                font-size: 0.9em;
-                line-height: 1.5;
-                border: none !important;
-                background: inherit;
-            }
-            
-            blockquote {
-                border-left: 4px solid #3498db;
-                padding-left: 20px;
-                margin: 20px 0;
-                font-style: italic;
-                color: #7f8c8d;
-                background: #ecf0f1;
-                padding: 15px 20px;
-                border-radius: 0 8px 8px 0;
-            }
-            
-            table {
-                width: 100%;
-                border-collapse: collapse;
-                margin: 20px 0;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.05);
-                page-break-inside: avoid;
-            }
-            
-            th {
-                background: #3498db;
-                color: white;
-                padding: 12px;
-                text-align: left;
-                font-weight: 600;
-            }
-            
-            td {
-                padding: 12px;
-                border-bottom: 1px solid #ecf0f1;
-            }
-            
-            tr:nth-child(even) { background: #f8f9fa; }
-            
-            strong { font-weight: 600; color: #2c3e50; }
-            
-            img {
-                max-width: 100%;
-                height: auto;
-                display: block;
-                margin: 20px auto;
-                border-radius: 8px;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            }
-            
-            .mermaid-diagram {
-                text-align: center;
-                margin: 20px 0;
-            }
-            
-            .mermaid-diagram svg {
-                max-width: 100%;
-                height: auto;
-            }
-            
-            @media print {
-                body { padding: 20px; }
-                h1, h2, h3, h4 { page-break-after: avoid; }
-                pre, table, img, .highlight { page-break-inside: avoid; }
-            }
-        """,
-        Theme.DARK: """
-            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;700&display=swap');
-            @import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;500;600&display=swap');
-            
-            body {
-                font-family: 'Inter', sans-serif;
-                line-height: 1.7;
-                color: #e0e0e0;
-                background: #1a1a1a;
-                padding: 40px;
-                max-width: 1200px;
-                margin: 0 auto;
-            }
-            
-            h1, h2, h3, h4 { color: #ffffff; }
-            h1 { border-bottom-color: #4a9eff; }
-            h2 { border-bottom-color: #333; }
-            
-            code { background: #2d2d2d; color: #f92672; }
-            pre { background: #2d2d2d; color: #f8f8f2; }
-            
-            blockquote {
-                background: #2d2d2d;
-                border-left-color: #4a9eff;
-                color: #b0b0b0;
-            }
-            
-            table { background: #2d2d2d; }
-            th { background: #4a9eff; }
-            td { border-bottom-color: #333; }
-            tr:nth-child(even) { background: #252525; }
-            
-            .mermaid-diagram {
-                background: white;
-                padding: 20px;
-                border-radius: 8px;
-                margin: 20px 0;
-            }
-        """,
-        Theme.GITHUB: """
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Noto Sans', Helvetica, Arial, sans-serif;
-                line-height: 1.5;
-                color: #24292e;
-                background: #ffffff;
-                padding: 32px;
-                max-width: 980px;
-                margin: 0 auto;
-            }
-            
-            h1 {
-                padding-bottom: 0.3em;
-                font-size: 2em;
-                border-bottom: 1px solid #eaecef;
-            }
-            
-            h2 {
-                padding-bottom: 0.3em;
-                font-size: 1.5em;
-                border-bottom: 1px solid #eaecef;
-            }
-            
-            code {
-                padding: 0.2em 0.4em;
-                margin: 0;
-                font-size: 85%;
-                background-color: rgba(27,31,35,0.05);
-                border-radius: 3px;
-            }
-            
-            pre {
-                padding: 16px;
-                overflow: auto;
-                font-size: 85%;
-                line-height: 1.45;
-                background-color: #f6f8fa;
-                border-radius: 6px;
-            }
-            
-            blockquote {
-                padding: 0 1em;
-                color: #6a737d;
-                border-left: 0.25em solid #dfe2e5;
-            }
+
+MERMAID_CDN_URL = "https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"
+MERMAID_JS_ENV = "MD_CONVERTER_MERMAID_JS"
+VENDORED_MERMAID_JS = Path(__file__).resolve().parent / "vendor" / "mermaid.min.js"
+
+
+def resolve_mermaid_script(mermaid_js: Optional[str] = None) -> Dict[str, str]:
+    """
+    Определяет, откуда подключать Mermaid при локальном рендеринге
+
+    Порядок: настройка mermaid_js (путь или URL), переменная окружения
+    MD_CONVERTER_MERMAID_JS, копия рядом с модулем (vendor/mermaid.min.js),
+    и только затем CDN.
+
+    Returns:
+        {"path": ...} для локального файла или {"url": ...}
+    """
+    for candidate in (mermaid_js, os.environ.get(MERMAID_JS_ENV)):
+        if not candidate:
+            continue
+        if re.match(r"^[a-z][a-z0-9+.-]*://", candidate, re.I):
+            return {"url": candidate}
+        path = Path(candidate).expanduser()
+        if not path.is_file():
+            raise FileNotFoundError(f"Файл Mermaid не найден: {path}")
+        return {"path": str(path.resolve())}
+    if VENDORED_MERMAID_JS.is_file():
+        return {"path": str(VENDORED_MERMAID_JS)}
+    return {"url": MERMAID_CDN_URL}
+
+
+MANIFEST_NAME = ".md_converter_manifest.json"
+
+# Настройки, которые не влияют на содержимое результата
+_NON_OUTPUT_CONFIG = {
+    "verbose",
+    "raise_errors",
+    "debug_dir",
+    "profile",
+    "profile_json",
+    "profile_memory",
+    "pdf_concurrency",
+    "incremental",
+    "manifest_file",
+    "mermaid_cache",
+    "cache_dir",
+    "cache_max_mb",
+    "wait_mode",
+    "render_timeout",
+    "fixed_wait",
+    "wait_network_idle",
+    "online_workers",
+    "online_timeout",
+    "online_retries",
+    "highlight_cache",
+    "highlight_cache_persistent",
+    "parallel_highlight",
+    "parallel_highlight_threshold",
+    "highlight_workers",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _converter_version() -> str:
+    """Хэш исходного кода конвертера: его изменение делает результаты устаревшими"""
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+def input_fingerprint(
+    input_file: Path,
+    output_format: "OutputFormat",
+    code_style: str,
+    theme: "Theme",
+    config: Dict[str, Any],
+    use_online: bool,
+) -> str:
+    """
+    Отпечаток всех входных данных, определяющих результат конвертации
+
+    Учитывает содержимое Markdown файла, тему, стиль подсветки, формат,
+    способ рендеринга диаграмм, влияющие на результат настройки и версию
+    самого конвертера.
+    """
+    options = {
+        key: value for key, value in config.items() if key not in _NON_OUTPUT_CONFIG
+    }
+    return DiskCache.make_key(
+        _converter_version(),
+        hashlib.sha256(Path(input_file).read_bytes()).hexdigest(),
+        output_format.value,
+        code_style,
+        theme.value,
+        str(use_online),
+        json.dumps(options, sort_keys=True, default=str),
+    )
+
+
+class BuildManifest:
+    """
+    Манифест инкрементальной сборки
+
+    Хранит для каждого выходного файла отпечаток входных данных, из которых
+    он был получен. Результат считается актуальным, если файл существует и
+    отпечаток не изменился.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.outputs: Dict[str, str] = {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.outputs = dict(data.get("outputs", {}))
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    @staticmethod
+    def _key(output_file: Path) -> str:
+        return str(Path(output_file).resolve())
+
+    def is_fresh(self, output_file: Path, fingerprint: str) -> bool:
+        """Проверяет, что результат существует и собран из тех же входных данных"""
+        return (
+            Path(output_file).exists()
+            and self.outputs.get(self._key(output_file)) == fingerprint
+        )
+
+    def record(self, output_file: Path, fingerprint: str) -> None:
+        """Запоминает отпечаток входных данных результата"""
+        self.outputs[self._key(output_file)] = fingerprint
+
+    def save(self) -> None:
+        """Атомарно сохраняет манифест на диск"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(
+            json.dumps({"version": 1, "outputs": self.outputs}, indent=1, sort_keys=True),
+            encoding="utf-8",
+        )
+        os.replace(tmp_path, self.path)
+
+
+class DiskCache:
+    """
+    Content-addressed кэш на диске с ограничением размера
+
+    Записи адресуются хэшем содержимого и хранятся как обычные файлы.
+    При превышении лимита удаляются записи, к которым дольше всего не было
+    обращений (время доступа отслеживается через mtime файла), до
+    LOW_WATER от лимита - чтобы следующие записи не сканировали кэш заново.
+    Записи больше лимита не кэшируются.
+    """
+
+    # Доля лимита, до которой кэш очищается при переполнении
+    LOW_WATER = 0.9
+
+    def __init__(self, directory: Path, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size: Optional[int] = None
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Строит ключ кэша из частей (рендерер, тип вывода, исходный код...)"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str, suffix: str) -> Path:
+        return self.directory / key[:2] / f"{key}{suffix}"
+
+    def get(self, key: str, suffix: str) -> Optional[Path]:
+        """Возвращает путь к записи или None, если её нет в кэше"""
+        path = self._entry_path(key, suffix)
+        try:
+            # Обновляем время доступа для LRU
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put_bytes(self, key: str, suffix: str, data: bytes) -> Optional[Path]:
+        """
+        Сохраняет данные в кэш и возвращает путь к записи
+
+        Returns:
+            Путь к записи или None, если данные больше лимита кэша
+        """
+        if len(data) > self.max_bytes:
+            return None
+        path = self._entry_path(key, suffix)
+        path.parent.mkdir(exist_ok=True)
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data) - replaced
+        if self._size > self.max_bytes:
+            self._evict(keep=path)
+        return path
+
+    def put_file(self, key: str, suffix: str, source: Path) -> Optional[Path]:
+        """Сохраняет файл в кэш и возвращает путь к записи (см. put_bytes)"""
+        return self.put_bytes(key, suffix, Path(source).read_bytes())
+
+    def _entries(self):
+        for path in self.directory.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self, keep: Optional[Path] = None) -> None:
+        """Удаляет давно не используемые записи (кроме keep) до LOW_WATER лимита"""
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * self.LOW_WATER)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._size = total
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Статистика обращений к кэшу"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class LRUCache:
+    """
+    Простой LRU-кэш в памяти с ограничением числа записей
+
+    При заданном max_chars ограничен и суммарный размер строковых значений;
+    значения длиннее восьмой части лимита не кэшируются, чтобы один огромный
+    блок не вытеснял весь кэш.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_chars: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.chars = 0
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return None
+        return self._data[key]
+
+    @staticmethod
+    def _size(value: Any) -> int:
+        return len(value) if isinstance(value, str) else 0
+
+    def put(self, key: str, value: Any) -> None:
+        size = self._size(value)
+        if self.max_chars is not None and size > self.max_chars // 8:
+            return
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self.chars -= self._size(previous)
+        self._data[key] = value
+        self.chars += size
+        while len(self._data) > self.max_entries or (
+            self.max_chars is not None and self.chars > self.max_chars
+        ):
+            _, evicted = self._data.popitem(last=False)
+            self.chars -= self._size(evicted)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Подсвеченный HTML, общий для всех документов процесса (не больше 32 млн
+# символов, иначе кэш больших сгенерированных файлов съест память)
+_HIGHLIGHT_MEMORY = LRUCache(max_entries=4096, max_chars=32 * 1024 * 1024)
+
+
+class HighlightCache:
+    """
+    Кэш подсвеченного HTML блоков кода
+
+    Записи хранятся в LRU-кэше в памяти, общем для всех конвертеров процесса
+    (пакетная обработка, сервер), и, если передан disk, дублируются в
+    DiskCache, чтобы повторные сборки тоже могли их использовать.
+    """
+
+    def __init__(
+        self, memory: Optional[LRUCache] = None, disk: Optional[DiskCache] = None
+    ):
+        self.memory = memory if memory is not None else _HIGHLIGHT_MEMORY
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает HTML по ключу или None"""
+        html = self.memory.get(key)
+        if html is None and self.disk is not None:
+            path = self.disk.get(key, ".html")
+            if path is not None:
+                try:
+                    html = path.read_text(encoding="utf-8")
+                except OSError:
+                    html = None
+                else:
+                    self.memory.put(key, html)
+
+        if html is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return html
+
+    def put(self, key: str, html: str) -> None:
+        """Сохраняет HTML по ключу"""
+        self.memory.put(key, html)
+        if self.disk is not None:
+            try:
+                self.disk.put_bytes(key, ".html", html.encode("utf-8"))
+            except OSError:
+                pass
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Статистика обращений к кэшу"""
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class KrokiClient:
+    """
+    Клиент сервиса Kroki для онлайн-рендеринга диаграмм
+
+    Все запросы идут через одну keep-alive сессию с пулом соединений,
+    таймаутом и повторами при сетевых ошибках и ответах 429/5xx.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "https://kroki.io",
+        max_workers: int = 4,
+        timeout: float = 15.0,
+        retries: int = 3,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+
+        requests = _require("requests", "requests", "онлайн-рендеринга диаграмм")
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_workers, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def render(self, diagram_code: str, output_type: str = "svg") -> str:
+        """Рендерит одну диаграмму и возвращает результат (SVG текст)"""
+        response = self.session.post(
+            f"{self.base_url}/mermaid/{output_type}",
+            data=diagram_code.encode("utf-8"),
+            headers={"Content-Type": "text/plain"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.text
+
+    def render_many(
+        self, diagrams: List[str], output_type: str = "svg"
+    ) -> List[Union[str, Exception]]:
+        """
+        Рендерит диаграммы параллельно (не более max_workers запросов сразу)
+
+        Returns:
+            Результаты в порядке входных диаграмм; для неудачных - исключение
+        """
+        if not diagrams:
+            return []
+
+        def render_safe(diagram_code: str) -> Union[str, Exception]:
+            try:
+                return self.render(diagram_code, output_type)
+            except Exception as e:
+                return e
+
+        workers = min(self.max_workers, len(diagrams))
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(render_safe, diagrams))
+
+    def close(self) -> None:
+        """Закрывает HTTP сессию"""
+        self.session.close()
+
+
+# Лексеры Pygments по имени языка (None - язык неизвестен)
+def get_cached_lexer(language: str):
+    """Возвращает лексер для языка, создавая его один раз на процесс"""
+    return _lexer_by_name(language.lower())
+
+
+# Имена языков берутся из документов (в том числе неизвестные), поэтому
+# кэш ограничен - иначе долгоживущий сервис копил бы их без предела
+@functools.lru_cache(maxsize=256)
+def _lexer_by_name(name: str):
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        return get_lexer_by_name(name, stripall=True)
+    except ClassNotFound:
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _guess_lexer_cached(sample: str):
+    from pygments.lexers import guess_lexer
+
+    return guess_lexer(sample)
+
+
+def resolve_lexer(
+    code: str,
+    language: Optional[str] = None,
+    default_language: Optional[str] = None,
+    guess: bool = True,
+    guess_prefix: Optional[int] = 4096,
+):
+    """
+    Подбирает лексер для блока кода
+
+    Порядок: указанный язык, язык по умолчанию, угадывание по содержимому
+    (анализируется только первые guess_prefix символов) и, если угадывание
+    отключено, простой текст.
+    """
+    if language:
+        lexer = get_cached_lexer(language)
+        if lexer is not None:
+            return lexer
+
+    if default_language:
+        lexer = get_cached_lexer(default_language)
+        if lexer is not None:
+            return lexer
+
+    if guess:
+        sample = code[:guess_prefix] if guess_prefix else code
+        return _guess_lexer_cached(sample)
+
+    return get_cached_lexer("text")
+
+
+def escape_html(text: str) -> str:
+    """Экранирует HTML символы"""
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("'", "&#39;")
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_formatter(code_style: str):
+    """HTML форматтер Pygments для стиля (создаётся один раз на процесс)"""
+    _require("pygments", "pygments", "подсветки синтаксиса")
+    from pygments.formatters import HtmlFormatter
+
+    return HtmlFormatter(
+        style=code_style,
+        cssclass="highlight",
+        nowrap=False,
+        noclasses=False,
+        nobackground=False,
+        linenos=False,
+    )
+
+
+def highlight_source(
+    code: str,
+    language: Optional[str],
+    code_style: str,
+    lexer_options: Dict[str, Any],
+) -> str:
+    """
+    Подсвечивает блок кода используя Pygments
+
+    Args:
+        code: Код для подсветки
+        language: Язык программирования
+        code_style: Стиль подсветки
+        lexer_options: Параметры resolve_lexer()
+
+    Returns:
+        HTML с подсвеченным кодом
+    """
+    from pygments import highlight
+
+    try:
+        lexer = resolve_lexer(code, language, **lexer_options)
+        return highlight(code, lexer, get_code_formatter(code_style))
+    except Exception:
+        return f'<pre class="highlight"><code>{escape_html(code)}</code></pre>'
+
+
+def _highlight_task(args: Tuple[str, Optional[str], str, Dict[str, Any]]) -> str:
+    """Задача подсветки для пула процессов"""
+    return highlight_source(*args)
+
+
+class FencedBlock(NamedTuple):
+    """Огороженный блок кода (``` или ~~~) в Markdown документе"""
+
+    start: int
+    end: int
+    source: str
+    info: str
+    language: Optional[str]
+    code: str
+    # Отступ открывающей строки (блок внутри элемента списка и т.п.)
+    indent: str = ""
+
+    @property
+    def is_mermaid(self) -> bool:
+        return (self.language or "").lower() == "mermaid"
+
+
+_FENCE_OPEN = re.compile(r"^(?P<indent>[ \t]*)(?P<fence>`{3,}|~{3,})(?P<info>[^\n]*)$", re.M)
+
+
+@functools.lru_cache(maxsize=64)
+def _fence_close_pattern(fence: str) -> "re.Pattern":
+    """Шаблон закрывающей строки: тот же символ, не короче открывающей"""
+    char = re.escape(fence[0])
+    return re.compile(rf"^[ \t]*{char}{{{len(fence)},}}[ \t]*\r?$", re.M)
+
+
+def _fence_language(info: str) -> Optional[str]:
+    """Извлекает язык из info-строки (`python`, `python title="x"`, `{.python}`)"""
+    info = info.strip()
+    if info.startswith("{"):
+        match = re.search(r"\.([^\s.#{}]+)", info)
+        return match.group(1) if match else None
+    language = re.split(r"[\s{]", info, maxsplit=1)[0]
+    return language or None
+
+
+def iter_fenced_blocks(content: str):
+    """
+    Находит огороженные блоки кода за один линейный проход
+
+    Поддерживает ``` и ~~~ любой длины от трёх символов (блок закрывается
+    строкой из того же символа не короче открывающей) и info-строки с
+    атрибутами. Незакрытый блок считается обычным текстом.
+
+    Yields:
+        FencedBlock в порядке следования в документе
+    """
+    position = 0
+    while True:
+        opening = _FENCE_OPEN.search(content, position)
+        if opening is None:
+            return
+
+        fence = opening.group("fence")
+        info = opening.group("info")
+        if fence[0] == "`" and "`" in info:
+            # Это inline-код, а не блок
+            position = opening.end() + 1
+            continue
+
+        body_start = opening.end() + 1
+        closing = _fence_close_pattern(fence).search(content, body_start)
+        if closing is None:
+            position = body_start
+            continue
+
+        code = content[body_start : max(body_start, closing.start() - 1)]
+        indent = opening.group("indent")
+        if indent:
+            # Убираем отступ открывающей строки из строк блока
+            code = re.sub(rf"^[ \t]{{0,{len(indent)}}}", "", code, flags=re.M)
+
+        yield FencedBlock(
+            start=opening.start(),
+            end=closing.end(),
+            source=content[opening.start() : closing.end()],
+            info=info.strip(),
+            language=_fence_language(info),
+            code=code,
+            indent=indent,
+        )
+        position = closing.end()
+
+
+def split_fenced_blocks(content: str) -> List[Union[str, FencedBlock]]:
+    """Разбивает документ на текстовые фрагменты и огороженные блоки кода"""
+    segments: List[Union[str, FencedBlock]] = []
+    position = 0
+    for block in iter_fenced_blocks(content):
+        if block.start > position:
+            segments.append(content[position : block.start])
+        segments.append(block)
+        position = block.end
+    if position < len(content):
+        segments.append(content[position:])
+    return segments
+
+
+_HEADING_LINE = re.compile(r"^#{1,6}(?:[ \t]|$)")
+
+
+def iter_markdown_sections(
+    lines: Iterable[str], max_chars: int = 4 * 1024 * 1024
+) -> Iterator[str]:
+    """
+    Разбивает поток строк Markdown на независимо конвертируемые фрагменты
+
+    Граница фрагмента - заголовок первого уровня вне блока кода. Если
+    фрагмент превысил max_chars символов, он завершается на ближайшем
+    заголовке любого уровня (тоже вне блока кода).
+
+    Args:
+        lines: Строки документа (с символами перевода строки), например файл
+
+    Yields:
+        Фрагменты документа; их конкатенация равна исходному тексту
+    """
+    buffer: List[str] = []
+    size = 0
+    fence: Optional[str] = None
+
+    for line in lines:
+        if fence is None:
+            opening = _FENCE_OPEN.match(line)
+            if opening and not (
+                opening.group("fence")[0] == "`" and "`" in opening.group("info")
+            ):
+                fence = opening.group("fence")
+            elif buffer and _HEADING_LINE.match(line):
+                if line.startswith("# ") or size >= max_chars:
+                    yield "".join(buffer)
+                    buffer = []
+                    size = 0
+        elif _fence_close_pattern(fence).match(line):
+            fence = None
+
+        buffer.append(line)
+        size += len(line)
+
+    if buffer:
+        yield "".join(buffer)
+
+
+_TAG = re.compile(r"<[^>]+>")
+_ELEMENT_ID = re.compile(r'\sid="([^"]+)"')
+_LOCAL_LINK = re.compile(r'href="#([^"]+)"')
+
+
+@functools.lru_cache(maxsize=None)
+def _heading_patterns(level: int) -> Tuple["re.Pattern", "re.Pattern"]:
+    """Начало заголовка уровня не глубже level и сам элемент заголовка"""
+    return (
+        re.compile(rf"<h[1-{level}][\s>]", re.I),
+        re.compile(rf"<h([1-{level}])\b[^>]*>(.*?)</h\1\s*>", re.I | re.S),
+    )
+
+
+def heading_text(html_fragment: str) -> str:
+    """Текст заголовка без тегов (для закладок и навигации)"""
+    import html
+
+    return html.unescape(_TAG.sub("", html_fragment)).strip()
+
+
+def split_html_sections(
+    html_body: str, min_chars: int = 0, level: int = 1
+) -> List[Tuple[str, str]]:
+    """
+    Делит HTML содержимое на разделы по заголовкам <h1> (до <h{level}>)
+
+    Подсвеченный код экранирован, поэтому "<h1" внутри блоков кода не
+    встречается. Соседние разделы объединяются, пока раздел короче
+    min_chars - слишком мелкие части печатать отдельно невыгодно.
+
+    Returns:
+        Список (заголовок первого раздела части, HTML части)
+    """
+    heading_start, heading_element = _heading_patterns(level)
+    starts = [match.start() for match in heading_start.finditer(html_body)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts[1:] + [len(html_body)]
+
+    sections: List[Tuple[str, str]] = []
+    for start, end in zip(starts, bounds):
+        chunk = html_body[start:end]
+        heading = heading_element.match(chunk)
+        title = heading_text(heading.group(2)) if heading else ""
+        if sections and len(sections[-1][1]) < min_chars:
+            previous_title, previous = sections[-1]
+            sections[-1] = (previous_title or title, previous + chunk)
+        else:
+            sections.append((title, chunk))
+    return sections
+
+
+# Экземпляры Markdown по набору расширений, свои для каждого потока
+_MARKDOWN_ENGINES = threading.local()
+
+
+def get_markdown_engine(extensions: Tuple[str, ...]):
+    """
+    Возвращает настроенный экземпляр Markdown для набора расширений
+
+    Создание экземпляра загружает все расширения, поэтому он создаётся один
+    раз и переиспользуется; перед каждым документом нужно вызвать reset().
+    Экземпляр Markdown не потокобезопасен, поэтому у каждого потока свой.
+    """
+    engines = getattr(_MARKDOWN_ENGINES, "engines", None)
+    if engines is None:
+        engines = _MARKDOWN_ENGINES.engines = {}
+
+    engine = engines.get(extensions)
+    if engine is None:
+        markdown = _require("markdown", "markdown", "конвертации Markdown")
+        engine = engines[extensions] = markdown.Markdown(extensions=list(extensions))
+    return engine
+
+
+# CSS документов по (класс конвертера, тема, стиль подсветки)
+_STYLESHEET_CACHE: Dict[Tuple[Any, ...], str] = {}
+
+
+def write_shared_stylesheet(
+    directory: Path, css: str, precompress: Iterable[str] = ()
+) -> Path:
+    """
+    Записывает файл стилей с именем по хэшу содержимого (если его ещё нет)
+
+    Args:
+        precompress: Сжатые копии, которые нужно записать рядом (см.
+            write_precompressed)
+
+    Returns:
+        Путь к файлу стилей
+    """
+    digest = hashlib.sha256(css.encode("utf-8")).hexdigest()[:16]
+    css_file = Path(directory) / f"md-{digest}.css"
+    if not css_file.exists():
+        css_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = css_file.with_name(f"{css_file.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(css, encoding="utf-8")
+        os.replace(tmp_path, css_file)
+        write_precompressed(css_file, precompress)
+    return css_file
+
+
+def write_asset(directory: Path, data: bytes, suffix: str) -> Path:
+    """
+    Записывает файл ресурса (диаграммы) с именем по хэшу содержимого
+
+    Файл с тем же содержимым не перезаписывается, поэтому браузер может
+    кэшировать ресурсы навсегда, а повторная сборка не трогает неизменённые.
+
+    Returns:
+        Путь к файлу ресурса
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    asset_file = Path(directory) / f"{digest}{suffix}"
+    if not asset_file.exists():
+        asset_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = asset_file.with_name(f"{asset_file.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, asset_file)
+    return asset_file
+
+
+_SVG_VIEWBOX = re.compile(
+    r'<svg\b[^>]*?\sviewBox="\s*[-\d.]+[\s,]+[-\d.]+[\s,]+([\d.]+)[\s,]+([\d.]+)\s*"'
+)
+
+
+def svg_size(svg: str) -> Optional[Tuple[int, int]]:
+    """Размеры SVG по атрибуту viewBox (None, если его нет)"""
+    match = _SVG_VIEWBOX.search(svg[:4096])
+    if not match:
+        return None
+    width, height = (round(float(value)) for value in match.groups())
+    return (width, height) if width and height else None
+
+
+_CSS_TOKEN = re.compile(
+    r"(?P<string>\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')"
+    r"|(?P<comment>/\*.*?\*/)"
+    r"|(?P<space>\s+)",
+    re.S,
+)
+# После этих символов и перед ними пробелы в CSS не нужны
+_CSS_TIGHT = set("{};,")
+
+
+def minify_css(css: str) -> str:
+    """Минифицирует CSS: убирает комментарии и лишние пробелы, не трогая строки"""
+
+    def replace(match: "re.Match") -> str:
+        if match.lastgroup == "string":
+            return match.group(0)
+        if match.lastgroup == "comment":
+            return ""
+        before = css[match.start() - 1] if match.start() else "{"
+        after = css[match.end()] if match.end() < len(css) else "}"
+        if before in _CSS_TIGHT or before == ":" or after in _CSS_TIGHT:
+            return ""
+        return " "
+
+    css = _CSS_TOKEN.sub(replace, css)
+    return css.replace(";}", "}").strip()
+
+
+_HTML_TOKEN = re.compile(
+    r"(?P<comment><!--(?!\[if).*?-->)"
+    r"|(?P<raw><(?P<tag>pre|textarea|script|style)\b[^>]*>.*?</(?P=tag)\s*>)"
+    r"|(?P<space>\s+)",
+    re.S | re.I,
+)
+_STYLE_BODY = re.compile(r"(<style\b[^>]*>)(.*?)(</style\s*>)", re.S | re.I)
+
+
+def minify_html(html_content: str) -> str:
+    """
+    Минифицирует HTML за один проход
+
+    Убирает комментарии и форматирующие пробелы: пробелы между тегами
+    схлопываются в один (между строчными элементами пробел значим),
+    отступы в начале строк - в перевод строки. Содержимое <pre>,
+    <textarea> и <script> не меняется, CSS в <style> минифицируется.
+    """
+
+    def replace(match: "re.Match") -> str:
+        kind = match.lastgroup
+        if kind == "comment":
+            return ""
+        if kind == "space":
+            whitespace = match.group(0)
+            if "\n" not in whitespace:
+                return " "
+            start, end = match.start(), match.end()
+            if (
+                start
+                and html_content[start - 1] == ">"
+                and html_content[end : end + 1] == "<"
+            ):
+                return " "
+            return "\n"
+        # Блок с сохраняемым содержимым
+        block = match.group(0)
+        if match.group("tag").lower() == "style":
+            return _STYLE_BODY.sub(
+                lambda style: style.group(1) + minify_css(style.group(2)) + style.group(3),
+                block,
+            )
+        return block
+
+    return _HTML_TOKEN.sub(replace, html_content).strip()
+
+
+def write_precompressed(path: Path, encodings: Iterable[str]) -> List[Path]:
+    """
+    Записывает рядом с файлом сжатые копии (.gz, .br) для статических серверов
+
+    Сжатие потоковое, файл не загружается в память целиком. gzip пишется
+    без времени модификации в заголовке, поэтому результат воспроизводим.
+
+    Args:
+        path: Исходный файл
+        encodings: "gzip" и/или "br" (нужен пакет brotli)
+
+    Returns:
+        Пути к созданным файлам
+    """
+    import gzip
+    import shutil
+
+    path = Path(path)
+    written = []
+    for encoding in encodings:
+        if encoding == "gzip":
+            target = path.with_name(path.name + ".gz")
+            with path.open("rb") as source, target.open("wb") as raw:
+                with gzip.GzipFile(
+                    filename="", mode="wb", fileobj=raw, compresslevel=9, mtime=0
+                ) as compressed:
+                    shutil.copyfileobj(source, compressed)
+        elif encoding == "br":
+            brotli = _require("brotli", "brotli", "сжатия Brotli")
+            target = path.with_name(path.name + ".br")
+            compressor = brotli.Compressor(quality=11)
+            with path.open("rb") as source, target.open("wb") as compressed:
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    compressed.write(compressor.process(chunk))
+                compressed.write(compressor.finish())
+        else:
+            raise ValueError(f"Неподдерживаемое сжатие: {encoding}")
+        written.append(target)
+    return written
+
+
+_SVG_PROLOG = re.compile(
+    r"<\?xml\b.*?\?>|<!DOCTYPE\b[^>]*>|<metadata\b.*?</metadata\s*>", re.S | re.I
+)
+
+
+_SVG_ROOT = re.compile(r"<svg\b[^>]*>")
+_SVG_ROOT_ID = re.compile(r'\sid="([^"]*)"')
+_SVG_ROOT_VIEWBOX = re.compile(r'\sviewBox="([^"]*)"')
+# Абсолютные размеры корня (в пикселях); проценты и em не подходят
+_SVG_ROOT_WIDTH = re.compile(r'\swidth="\s*([\d.]+)(?:px)?\s*"')
+_SVG_ROOT_HEIGHT = re.compile(r'\sheight="\s*([\d.]+)(?:px)?\s*"')
+
+
+def svg_with_id(svg: str, svg_id: str) -> str:
+    """
+    Задаёт корневому элементу SVG идентификатор svg_id
+
+    Прежний идентификатор заменяется вместе со ссылками на него (#id в
+    стилях и url(...)) и производными от него идентификаторами маркеров.
+    """
+    root = _SVG_ROOT.search(svg)
+    if root is None:
+        return svg
+    match = _SVG_ROOT_ID.search(root.group(0))
+    if match is None:
+        insert_at = root.start() + len("<svg")
+        return f'{svg[:insert_at]} id="{svg_id}"{svg[insert_at:]}'
+    old_id = match.group(1)
+    if not old_id or old_id == svg_id:
+        return svg
+    return svg.replace(f'id="{old_id}', f'id="{svg_id}').replace(
+        f"#{old_id}", f"#{svg_id}"
+    )
+
+
+def svg_reference(svg: str, svg_id: str) -> Optional[str]:
+    """
+    Ссылка <use> на уже встроенный в документ SVG с идентификатором svg_id
+
+    Повтор диаграммы отображается без скриптов и без копии содержимого.
+    Без viewBox область ссылки строится по атрибутам width/height корня;
+    возвращает None, если нет ни того, ни другого (размер не определить).
+    """
+    root = _SVG_ROOT.search(svg)
+    if root is None:
+        return None
+    viewbox = _SVG_ROOT_VIEWBOX.search(root.group(0))
+    if viewbox is not None:
+        size = svg_size(root.group(0))
+        size_attrs = f' width="{size[0]}" height="{size[1]}"' if size else ""
+        viewbox_value = viewbox.group(1)
+    else:
+        width = _SVG_ROOT_WIDTH.search(root.group(0))
+        height = _SVG_ROOT_HEIGHT.search(root.group(0))
+        if width is None or height is None:
+            return None
+        size_attrs = f' width="{width.group(1)}" height="{height.group(1)}"'
+        viewbox_value = f"0 0 {width.group(1)} {height.group(1)}"
+    return (
+        f'<svg viewBox="{viewbox_value}"{size_attrs} role="img">'
+        f'<use href="#{svg_id}" width="100%" height="100%"/></svg>'
+    )
+
+
+def minify_svg(svg: str) -> str:
+    """
+    Минифицирует SVG для встраивания в HTML
+
+    Убирает XML пролог, DOCTYPE и <metadata>, затем применяет minify_html():
+    комментарии, форматирующие пробелы между тегами, CSS внутри <style>.
+    """
+    return minify_html(_SVG_PROLOG.sub("", svg))
+
+
+def optimize_raster(data: bytes, image_format: str = "png", quality: int = 90) -> bytes:
+    """
+    Пережимает растровую диаграмму через Pillow
+
+    Args:
+        data: Исходный PNG
+        image_format: "png" (оптимизированный PNG) или "webp"
+        quality: Качество WebP (lossless при 100)
+
+    Returns:
+        Изображение в формате image_format
+    """
+    import io
+
+    image_module = _require("PIL.Image", "Pillow", "оптимизации изображений")
+
+    output = io.BytesIO()
+    with image_module.open(io.BytesIO(data)) as image:
+        if image_format == "webp":
+            image.save(
+                output, "WEBP", quality=quality, lossless=quality >= 100, method=6
+            )
+        elif image_format == "png":
+            image.save(output, "PNG", optimize=True)
+        else:
+            raise ValueError(f"Неподдерживаемый формат изображения: {image_format}")
+    optimized = output.getvalue()
+    # Оставляем исходный PNG, если пережатый не меньше
+    if image_format == "png" and len(optimized) >= len(data):
+        return data
+    return optimized
+
+
+_IMAGE_MIME = {".png": "image/png", ".webp": "image/webp", ".svg": "image/svg+xml"}
+
+
+def base64_file(path: Path, chunk_size: int = 3 * 64 * 1024) -> str:
+    """Кодирует файл в base64 блоками, не читая его в память целиком"""
+    # Размер блока кратен 3, поэтому части склеиваются без промежуточного '='
+    with Path(path).open("rb") as source:
+        return "".join(
+            base64.b64encode(chunk).decode("ascii")
+            for chunk in iter(lambda: source.read(chunk_size), b"")
+        )
+
+
+class StageProfiler:
+    """
+    Замеры времени и памяти по этапам конвертации
+
+    Для каждого этапа накапливаются время (wall) и процессорное время этого
+    процесса (cpu - без Chromium и воркеров). При trace_memory также
+    замеряется пик памяти, выделенной Python во время этапа (tracemalloc);
+    трассировка памяти заметно замедляет работу, поэтому время в этом
+    режиме завышено. Повторные вызовы этапа (например, по фрагментам в
+    потоковом режиме) суммируются. Выключенный профилировщик ничего не
+    измеряет и почти ничего не стоит.
+    """
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.stages: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self.counters: Dict[str, int] = {}
+        self._started_tracemalloc = False
+        if self.trace_memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Контекст замера этапа name"""
+        if not self.enabled:
+            yield
+            return
+        if self.trace_memory:
+            import tracemalloc
+
+            tracemalloc.reset_peak()
+            base_memory = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            peak = 0
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1] - base_memory, 0)
+            entry = self.stages.setdefault(
+                name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_bytes": 0}
+            )
+            entry["calls"] += 1
+            entry["wall"] += wall
+            entry["cpu"] += cpu
+            entry["peak_bytes"] = max(entry["peak_bytes"], peak)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Увеличивает счётчик name (блоки кода, диаграммы, символы)"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @staticmethod
+    def max_rss_kb() -> Optional[int]:
+        """Пиковый размер процесса в памяти (КБ) или None, если недоступен"""
+        try:
+            import resource
+        except ImportError:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS возвращает байты, Linux - килобайты
+        return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Результаты в виде, пригодном для JSON"""
+        stages = {}
+        for name, entry in self.stages.items():
+            stages[name] = {
+                "calls": entry["calls"],
+                "wall_ms": round(entry["wall"] * 1000, 3),
+                "cpu_ms": round(entry["cpu"] * 1000, 3),
+            }
+            if self.trace_memory:
+                stages[name]["peak_kb"] = round(entry["peak_bytes"] / 1024, 1)
+        return {
+            "stages": stages,
+            "total_wall_ms": round(
+                sum(entry["wall"] for entry in self.stages.values()) * 1000, 3
+            ),
+            "max_rss_kb": self.max_rss_kb(),
+            "counters": dict(self.counters),
+        }
+
+    def format_table(self) -> str:
+        """Таблица результатов для вывода в консоль"""
+        header = f"{'Этап':<12} {'вызовов':>8} {'время, мс':>11} {'CPU, мс':>11}"
+        if self.trace_memory:
+            header += f" {'пик, КБ':>11}"
+        lines = [header]
+        for name, entry in self.stages.items():
+            line = (
+                f"{name:<12} {entry['calls']:>8} {entry['wall'] * 1000:>11.1f} "
+                f"{entry['cpu'] * 1000:>11.1f}"
+            )
+            if self.trace_memory:
+                line += f" {entry['peak_bytes'] / 1024:>11.1f}"
+            lines.append(line)
+        total = sum(entry["wall"] for entry in self.stages.values())
+        lines.append(f"{'итого':<12} {'':>8} {total * 1000:>11.1f}")
+        max_rss = self.max_rss_kb()
+        if max_rss is not None:
+            lines.append(f"Пиковая память процесса: {max_rss / 1024:.1f} МБ")
+        if self.counters:
+            lines.append(
+                ", ".join(f"{name}: {value}" for name, value in self.counters.items())
+            )
+        return "\n".join(lines)
+
+    def write_json(self, path: Path, **extra: Any) -> None:
+        """Записывает результаты в JSON файл (extra - доп. поля, например имя файла)"""
+        data = dict(extra, **self.to_dict())
+        Path(path).write_text(
+            json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+
+    def close(self) -> None:
+        """Останавливает tracemalloc, если его запустил этот профилировщик"""
+        if self._started_tracemalloc:
+            import tracemalloc
+
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+# Страница, на которую загружается Mermaid (см. BrowserPool.mermaid_page)
+_MERMAID_PAGE = (
+    "<!DOCTYPE html><html><head><style>"
+    "body { background: white; } .mermaid { text-align: center; }"
+    "</style></head><body></body></html>"
+)
+
+
+class BrowserPool:
+    """
+    Пул Chromium для рендеринга через Playwright
+
+    Браузер запускается один раз при первом обращении и живёт до вызова
+    close(), а страница для диаграмм переиспользуется между рендерингами.
+    Один пул можно передать нескольким конвертерам (пакетная обработка).
+
+    Объекты синхронного Playwright привязаны к потоку, в котором созданы,
+    поэтому вся работа с браузером выполняется в собственном потоке пула:
+    submit() ставит функцию в очередь этого потока, call() дожидается её
+    результата. Так рендеринг диаграмм может идти в фоне, пока основной
+    поток подсвечивает код и разбирает Markdown.
+    """
+
+    def __init__(self, headless: bool = True):
+        self.headless = headless
+        self._playwright = None
+        self._browser = None
+        self._page = None
+        self._mermaid_page = None
+        self._mermaid_script: Optional[Dict[str, str]] = None
+        self._executor = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _remember_thread(self) -> None:
+        self._thread = threading.current_thread()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Выполняет fn(*args, **kwargs) в потоке браузера
+
+        Returns:
+            concurrent.futures.Future с результатом
+        """
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix="browser-pool",
+                    initializer=self._remember_thread,
+                )
+            return self._executor.submit(fn, *args, **kwargs)
+
+    def call(self, fn, *args, **kwargs):
+        """Выполняет fn в потоке браузера и возвращает результат"""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    @property
+    def browser(self):
+        """Запущенный браузер (запускается при первом обращении)"""
+        if self._browser is None:
+            sync_api = _require(
+                "playwright.sync_api",
+                "playwright",
+                "PDF и локального рендеринга Mermaid (после установки: "
+                "playwright install chromium)",
+            )
+            self._playwright = sync_api.sync_playwright().start()
+            try:
+                self._browser = self._playwright.chromium.launch(
+                    headless=self.headless
+                )
+            except Exception:
+                self._playwright.stop()
+                self._playwright = None
+                raise
+        return self._browser
+
+    def page(self):
+        """Возвращает переиспользуемую страницу для рендеринга диаграмм"""
+        if self._page is None or self._page.is_closed():
+            self._page = self.browser.new_page()
+        return self._page
+
+    def new_page(self):
+        """Создаёт отдельную страницу (закрывается вызывающим кодом)"""
+        return self.browser.new_page()
+
+    def mermaid_page(self, script: Dict[str, str]):
+        """
+        Возвращает страницу с загруженным и инициализированным Mermaid
+
+        Скрипт подключается один раз, страница переиспользуется для всех
+        диаграмм, пока не изменится источник скрипта.
+
+        Args:
+            script: Источник Mermaid из resolve_mermaid_script()
+        """
+        page = self._mermaid_page
+        if page is None or page.is_closed() or self._mermaid_script != script:
+            if page is None or page.is_closed():
+                page = self.browser.new_page()
+            self._mermaid_page = None
+            page.set_content(_MERMAID_PAGE)
+            page.add_script_tag(**script)
+            page.evaluate("mermaid.initialize({ startOnLoad: false })")
+            self._mermaid_page = page
+            self._mermaid_script = dict(script)
+        return page
+
+    def close(self) -> None:
+        """Закрывает браузер, останавливает Playwright и поток браузера"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            self._close_browser()
+            return
+        try:
+            executor.submit(self._close_browser).result()
+        finally:
+            executor.shutdown()
+            self._thread = None
+
+    def _close_browser(self) -> None:
+        try:
+            if self._browser is not None:
+                self._browser.close()
+        finally:
+            if self._playwright is not None:
+                self._playwright.stop()
+            self._playwright = None
+            self._browser = None
+            self._page = None
+            self._mermaid_page = None
+            self._mermaid_script = None
+
+    def __enter__(self) -> "BrowserPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _PendingDiagrams(NamedTuple):
+    """Диаграммы документа, рендеринг которых идёт в фоне"""
+
+    # Код диаграмм в порядке появления (индекс - номер метки)
+    codes: List[str]
+    # Future со словарём код -> путь (None, если диаграмм нет)
+    future: Any
+    # Подсвеченные блоки с отступом, подставляемые после Markdown
+    blocks: List[str] = []
+
+
+class UniversalMarkdownConverter:
+    """Универсальный конвертер Markdown в различные форматы"""
+
+    # CSS темы оформления
+    THEMES = {
+        Theme.DEFAULT: """
+            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;700&display=swap');
+            @import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;500;600&display=swap');
+            
+            * { margin: 0; padding: 0; box-sizing: border-box; }
+            
+            body {
+                font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+                line-height: 1.7;
+                color: #2c3e50;
+                background: white;
+                padding: 40px;
+                max-width: 1200px;
+                margin: 0 auto;
+            }
+            
+            h1 {
+                color: #2c3e50;
+                font-size: 2.5em;
+                margin-bottom: 20px;
+                padding-bottom: 10px;
+                border-bottom: 3px solid #3498db;
+                page-break-after: avoid;
+            }
+            
+            h2 {
+                color: #34495e;
+                font-size: 2em;
+                margin-top: 40px;
+                margin-bottom: 20px;
+                padding-bottom: 8px;
+                border-bottom: 2px solid #ecf0f1;
+                page-break-after: avoid;
+            }
+            
+            h3 {
+                color: #34495e;
+                font-size: 1.5em;
+                margin-top: 30px;
+                margin-bottom: 15px;
+                page-break-after: avoid;
+            }
+            
+            p { margin-bottom: 15px; text-align: justify; }
+            ul, ol { margin-bottom: 20px; padding-left: 30px; }
+            li { margin-bottom: 8px; }
+            
+            code {
+                background: #f8f9fa;
+                padding: 2px 6px;
+                border-radius: 4px;
+                font-family: 'JetBrains Mono', 'Consolas', 'Monaco', monospace;
+                font-size: 0.9em;
+                color: #e74c3c;
+            }
+            
+            pre {
+                background: #2c3e50;
+                color: #ecf0f1;
+                padding: 20px;
+                border-radius: 8px;
+                overflow-x: auto;
+                margin: 20px 0;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+                page-break-inside: avoid;
+                font-family: 'JetBrains Mono', 'Consolas', 'Monaco', monospace;
+                font-size: 0.9em;
+                line-height: 1.5;
+            }
+            
+            pre code {
+                background: none;
+                color: #ecf0f1;
+                padding: 0;
+            }
+            
+            .highlight {
+                border-radius: 8px;
+                margin: 20px 0;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+                overflow: hidden;
+                page-break-inside: avoid;
+            }
+            
+            .highlight pre {
+                margin: 0 !important;
+                padding: 20px;
+                overflow-x: auto;
+                font-family: 'JetBrains Mono', 'Consolas', 'Monaco', monospace;
+                font-size: 0.9em;
+                line-height: 1.5;
+                border: none !important;
+                background: inherit;
+            }
+            
+            blockquote {
+                border-left: 4px solid #3498db;
+                padding-left: 20px;
+                margin: 20px 0;
+                font-style: italic;
+                color: #7f8c8d;
+                background: #ecf0f1;
+                padding: 15px 20px;
+                border-radius: 0 8px 8px 0;
+            }
+            
+            table {
+                width: 100%;
+                border-collapse: collapse;
+                margin: 20px 0;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.05);
+                page-break-inside: avoid;
+            }
+            
+            th {
+                background: #3498db;
+                color: white;
+                padding: 12px;
+                text-align: left;
+                font-weight: 600;
+            }
+            
+            td {
+                padding: 12px;
+                border-bottom: 1px solid #ecf0f1;
+            }
+            
+            tr:nth-child(even) { background: #f8f9fa; }
+            
+            strong { font-weight: 600; color: #2c3e50; }
+            
+            img {
+                max-width: 100%;
+                height: auto;
+                display: block;
+                margin: 20px auto;
+                border-radius: 8px;
+                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+            }
+            
+            .mermaid-diagram {
+                text-align: center;
+                margin: 20px 0;
+            }
+            
+            .mermaid-diagram svg {
+                max-width: 100%;
+                height: auto;
+            }
+            
+            @media print {
+                body { padding: 20px; }
+                h1, h2, h3, h4 { page-break-after: avoid; }
+                pre, table, img, .highlight { page-break-inside: avoid; }
+            }
+        """,
+        Theme.DARK: """
+            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;700&display=swap');
+            @import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;500;600&display=swap');
+            
+            body {
+                font-family: 'Inter', sans-serif;
+                line-height: 1.7;
+                color: #e0e0e0;
+                background: #1a1a1a;
+                padding: 40px;
+                max-width: 1200px;
+                margin: 0 auto;
+            }
+            
+            h1, h2, h3, h4 { color: #ffffff; }
+            h1 { border-bottom-color: #4a9eff; }
+            h2 { border-bottom-color: #333; }
+            
+            code { background: #2d2d2d; color: #f92672; }
+            pre { background: #2d2d2d; color: #f8f8f2; }
+            
+            blockquote {
+                background: #2d2d2d;
+                border-left-color: #4a9eff;
+                color: #b0b0b0;
+            }
+            
+            table { background: #2d2d2d; }
+            th { background: #4a9eff; }
+            td { border-bottom-color: #333; }
+            tr:nth-child(even) { background: #252525; }
+            
+            .mermaid-diagram {
+                background: white;
+                padding: 20px;
+                border-radius: 8px;
+                margin: 20px 0;
+            }
+        """,
+        Theme.GITHUB: """
+            body {
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Noto Sans', Helvetica, Arial, sans-serif;
+                line-height: 1.5;
+                color: #24292e;
+                background: #ffffff;
+                padding: 32px;
+                max-width: 980px;
+                margin: 0 auto;
+            }
+            
+            h1 {
+                padding-bottom: 0.3em;
+                font-size: 2em;
+                border-bottom: 1px solid #eaecef;
+            }
+            
+            h2 {
+                padding-bottom: 0.3em;
+                font-size: 1.5em;
+                border-bottom: 1px solid #eaecef;
+            }
+            
+            code {
+                padding: 0.2em 0.4em;
+                margin: 0;
+                font-size: 85%;
+                background-color: rgba(27,31,35,0.05);
+                border-radius: 3px;
+            }
+            
+            pre {
+                padding: 16px;
+                overflow: auto;
+                font-size: 85%;
+                line-height: 1.45;
+                background-color: #f6f8fa;
+                border-radius: 6px;
+            }
+            
+            blockquote {
+                padding: 0 1em;
+                color: #6a737d;
+                border-left: 0.25em solid #dfe2e5;
+            }
         """,
         Theme.MINIMAL: """
             body {
@@ -349,428 +1726,2611 @@ class UniversalMarkdownConverter:
         """,
     }
 
+    # Навигация между страницами при разбиении HTML (split_pages)
+    PAGE_NAV_CSS = """
+            .page-nav {
+                display: flex;
+                justify-content: space-between;
+                gap: 1em;
+                margin: 20px 0;
+                font-size: 0.9em;
+            }
+            .page-nav a { text-decoration: none; }
+            .page-index ol { list-style: none; padding-left: 0; }
+            .page-index li { margin: 0.3em 0; }
+            .page-index .index-h2 { margin-left: 1.5em; }
+            .page-index .index-h3 { margin-left: 3em; }
+            .page-index .index-h4,
+            .page-index .index-h5,
+            .page-index .index-h6 { margin-left: 4.5em; }
+        """
+
+    def __init__(
+        self,
+        input_file: Optional[str] = None,
+        output_format: OutputFormat = OutputFormat.HTML,
+        output_file: Optional[str] = None,
+        code_style: str = "monokai",
+        theme: Theme = Theme.DEFAULT,
+        config: Optional[Dict[str, Any]] = None,
+        browser_pool: Optional[BrowserPool] = None,
+    ):
+        """
+        Инициализация конвертера
+
+        Args:
+            input_file: Путь к входному Markdown файлу (не нужен, если
+                конвертер используется только через render_string())
+            output_format: Формат выходного файла
+            output_file: Путь к выходному файлу (если не указан, генерируется автоматически)
+            code_style: Стиль подсветки синтаксиса кода
+            theme: Тема оформления документа
+            config: Дополнительные настройки конвертера
+            browser_pool: Общий пул Chromium (если не указан, конвертер
+                создаёт собственный и закрывает его в cleanup())
+        """
+        self.input_file = Path(input_file) if input_file else None
+        self.output_format = output_format
+        if output_file:
+            self.output_file = Path(output_file)
+        elif self.input_file:
+            self.output_file = self._generate_output_filename()
+        else:
+            self.output_file = None
+        self.code_style = code_style
+        self.theme = theme
+        self.config = self.apply_config_defaults(config or {})
+
+        # Промежуточные файлы не пишутся: страницы загружаются из памяти.
+        # Каталог создаётся только по необходимости или для отладки (debug_dir)
+        self._temp_dir: Optional[Path] = None
+        self._memory_diagrams: Dict[str, bytes] = {}
+        self.mermaid_counter = 0
+
+        # Замеры по этапам (--profile); выключенный профилировщик ничего не стоит
+        self.profiler = StageProfiler(
+            enabled=bool(self.config.get("profile")),
+            trace_memory=bool(self.config.get("profile_memory")),
+        )
+
+        # Диаграммы, уже встроенные в текущий документ: идентификатор ->
+        # ссылка <use> для повторов (пустая строка - ссылку не построить)
+        self._embedded_diagrams: Dict[str, str] = {}
+        # Ссылки на повторы невозможны, если документ печатается по частям
+        self._reference_repeats = True
+        # Каталог файлов диаграмм при разбиении HTML на страницы
+        self._asset_dir: Optional[Path] = None
+        self._pillow_missing = False
+
+        # Браузер запускается лениво и переиспользуется для всех диаграмм
+        self._browser_pool = browser_pool
+        self._owns_browser_pool = browser_pool is None
+        self._kroki_client: Optional[KrokiClient] = None
+        self._mermaid_script: Optional[Dict[str, str]] = None
+        # Поток фонового онлайн рендеринга и метка мест для диаграмм
+        self._diagram_executor = None
+        self._slot_prefix = f"mdslot{os.urandom(4).hex()}"
+
+        # Кэш отрендеренных диаграмм между запусками
+        self.mermaid_cache = self._create_mermaid_cache()
+
+        # Кэш подсвеченного кода (в памяти процесса и, опционально, на диске)
+        self.highlight_cache = self._create_highlight_cache()
+
+        # Форматтер для подсветки кода (общий для процесса)
+        self.code_formatter = get_code_formatter(code_style)
+
+        # Пул процессов для параллельной подсветки, создаётся по требованию
+        self._highlight_executor: Optional["ProcessPoolExecutor"] = None
+
+        # Расширения Markdown
+        self.markdown_extensions = [
+            "tables",
+            "fenced_code",
+            "nl2br",
+            "sane_lists",
+            "footnotes",
+            "attr_list",
+            "def_list",
+            "abbr",
+            "md_in_html",
+        ]
+
+        if self.config.get("include_toc"):
+            self.markdown_extensions.append("toc")
+
+    @staticmethod
+    def apply_config_defaults(config: Dict[str, Any]) -> Dict[str, Any]:
+        """Дополняет настройки значениями по умолчанию и возвращает их"""
+        config.setdefault("embed_images", True)
+        config.setdefault("standalone", True)
+        config.setdefault("minify", False)
+        config.setdefault("include_toc", False)
+        config.setdefault("mermaid_cache", True)
+        config.setdefault("cache_max_mb", 256)
+        # "ready" - ждать сигнала готовности страницы, "fixed" - фиксированная пауза
+        config.setdefault("wait_mode", "ready")
+        config.setdefault("render_timeout", 15000)
+        config.setdefault("fixed_wait", 2000)
+        config.setdefault("wait_network_idle", False)
+        config.setdefault("kroki_url", "https://kroki.io")
+        config.setdefault("online_workers", 4)
+        config.setdefault("online_timeout", 15.0)
+        config.setdefault("online_retries", 3)
+        # Определение языка блоков кода без указанного языка
+        config.setdefault("default_language", None)
+        config.setdefault("guess_language", True)
+        config.setdefault("guess_prefix", 4096)
+        config.setdefault("highlight_cache", True)
+        config.setdefault("highlight_cache_persistent", False)
+        # Параллельная подсветка для документов с большим объёмом кода
+        config.setdefault("parallel_highlight", False)
+        config.setdefault("parallel_highlight_threshold", 256 * 1024)
+        config.setdefault("highlight_workers", None)
+        # Потоковая обработка очень больших файлов
+        config.setdefault("streaming", False)
+        # Стили в общем внешнем файле вместо встраивания в каждую страницу
+        config.setdefault("external_css", False)
+        # Сжатые копии HTML для статических серверов: "gzip", "br"
+        config.setdefault("precompress", [])
+        config.setdefault("stream_chunk_chars", 4 * 1024 * 1024)
+        # Локальный рендеринг Mermaid: "svg" (mermaid.render) или "png" (снимок)
+        config.setdefault("mermaid_output", "svg")
+        config.setdefault("mermaid_js", None)
+        # Каталог для промежуточных файлов при отладке (по умолчанию - в памяти)
+        config.setdefault("debug_dir", None)
+        # Замеры по этапам: таблица в консоль и/или JSON (profile_json)
+        config.setdefault("profile", False)
+        config.setdefault("profile_json", None)
+        config.setdefault("profile_memory", False)
+        # Сколько PDF пакетной конвертации печатается одновременно
+        config.setdefault("pdf_concurrency", 4)
+        # Печать огромных документов по разделам (нужен пакет pypdf)
+        config.setdefault("pdf_sections", False)
+        config.setdefault("pdf_section_chars", 200_000)
+        config.setdefault("pdf_page_numbers", False)
+        # Разбиение HTML на страницы по заголовкам до этого уровня (1-6)
+        config.setdefault("split_pages", None)
+        # Растровые диаграммы: "png" или "webp", пережатие через Pillow
+        config.setdefault("image_format", "png")
+        config.setdefault("image_quality", 90)
+        config.setdefault("optimize_images", True)
+        config.setdefault("minify_svg", True)
+        return config
+
+    @property
+    def temp_dir(self) -> Path:
+        """
+        Каталог промежуточных файлов (создаётся при первом обращении)
+
+        При заданной настройке debug_dir промежуточные файлы (HTML страниц,
+        диаграммы) пишутся туда и не удаляются после конвертации.
+        """
+        if self._temp_dir is None:
+            debug_dir = self.config.get("debug_dir")
+            if debug_dir:
+                self._temp_dir = Path(debug_dir)
+                self._temp_dir.mkdir(parents=True, exist_ok=True)
+            else:
+                self._temp_dir = Path(tempfile.mkdtemp())
+        return self._temp_dir
+
+    def input_fingerprint(self, use_online_mermaid: bool = False) -> str:
+        """Отпечаток входных данных, от которых зависит результат конвертации"""
+        return input_fingerprint(
+            self.input_file,
+            self.output_format,
+            self.code_style,
+            self.theme,
+            self.config,
+            use_online_mermaid,
+        )
+
+    def _manifest_path(self) -> Path:
+        manifest_file = self.config.get("manifest_file")
+        if manifest_file:
+            return Path(manifest_file)
+        return self.output_file.parent / MANIFEST_NAME
+
+    def _create_mermaid_cache(self) -> Optional[DiskCache]:
+        """Создаёт дисковый кэш диаграмм согласно настройкам"""
+        if not self.config.get("mermaid_cache"):
+            return None
+
+        cache_dir = self.config.get("cache_dir") or default_cache_dir()
+        try:
+            return DiskCache(
+                Path(cache_dir) / "mermaid",
+                max_bytes=int(self.config["cache_max_mb"] * 1024 * 1024),
+            )
+        except OSError as e:
+            print(f"⚠️ Кэш диаграмм отключён: {e}")
+            return None
+
+    def _create_highlight_cache(self) -> Optional[HighlightCache]:
+        """Создаёт кэш подсвеченного кода согласно настройкам"""
+        if not self.config.get("highlight_cache"):
+            return None
+
+        disk = None
+        if self.config.get("highlight_cache_persistent"):
+            cache_dir = self.config.get("cache_dir") or default_cache_dir()
+            try:
+                disk = DiskCache(
+                    Path(cache_dir) / "highlight",
+                    max_bytes=int(self.config["cache_max_mb"] * 1024 * 1024),
+                )
+            except OSError as e:
+                print(f"⚠️ Дисковый кэш подсветки отключён: {e}")
+        return HighlightCache(disk=disk)
+
+    def _highlight_key(self, code: str, language: Optional[str]) -> str:
+        """Ключ кэша подсветки: код, язык, стиль и настройки выбора лексера"""
+        return DiskCache.make_key(
+            "highlight",
+            self.code_style,
+            language or "",
+            str(self.config.get("default_language") or ""),
+            str(self.config.get("guess_language")),
+            str(self.config.get("guess_prefix")),
+            code,
+        )
+
+    def _cached_diagram(self, renderer: str, output_type: str, diagram_code: str):
+        """Возвращает (ключ, путь) для диаграммы в кэше; путь None при промахе"""
+        if self.mermaid_cache is None:
+            return None, None
+        key = DiskCache.make_key(
+            renderer, self._renderer_source(renderer), output_type, diagram_code
+        )
+        return key, self.mermaid_cache.get(key, f".{output_type}")
+
+    def _renderer_source(self, renderer: str) -> str:
+        """
+        Источник рендеринга для ключа кэша диаграмм
+
+        Адрес сервиса Kroki для онлайн рендеринга; для локального - URL
+        Mermaid или путь к файлу с размером и временем изменения, чтобы
+        замена mermaid.min.js сбрасывала кэш.
+        """
+        if renderer == "online":
+            return self.config["kroki_url"].rstrip("/")
+        script = self.mermaid_script
+        if "url" in script:
+            return script["url"]
+        stat = Path(script["path"]).stat()
+        return f"{script['path']}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _generate_output_filename(self) -> Path:
+        """Генерирует имя выходного файла на основе формата"""
+        extensions = {OutputFormat.HTML: ".html", OutputFormat.PDF: ".pdf"}
+        return self.input_file.with_suffix(extensions[self.output_format])
+
+    def escape_html(self, text: str) -> str:
+        """Экранирует HTML символы"""
+        return escape_html(text)
+
+    def _lexer_options(self) -> Dict[str, Any]:
+        """Настройки выбора лексера для resolve_lexer()"""
+        return {
+            "default_language": self.config.get("default_language"),
+            "guess": self.config.get("guess_language"),
+            "guess_prefix": self.config.get("guess_prefix"),
+        }
+
+    def highlight_code_block(self, code: str, language: Optional[str] = None) -> str:
+        """
+        Подсвечивает блок кода используя Pygments
+
+        Args:
+            code: Код для подсветки
+            language: Язык программирования
+
+        Returns:
+            HTML с подсвеченным кодом
+        """
+        cache_key = None
+        if self.highlight_cache is not None:
+            cache_key = self._highlight_key(code, language)
+            cached = self.highlight_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        html = highlight_source(code, language, self.code_style, self._lexer_options())
+        if cache_key is not None:
+            self.highlight_cache.put(cache_key, html)
+        return html
+
+    def highlight_code_blocks(
+        self, blocks: List[Tuple[str, Optional[str]]]
+    ) -> List[str]:
+        """
+        Подсвечивает набор блоков кода
+
+        Если включена настройка parallel_highlight и суммарный объём кода,
+        которого нет в кэше, не меньше parallel_highlight_threshold символов,
+        блоки подсвечиваются в пуле процессов. Результат побайтно совпадает с
+        последовательной подсветкой: в обоих случаях используется
+        highlight_source().
+
+        Args:
+            blocks: Пары (код, язык)
+
+        Returns:
+            HTML в порядке входных блоков
+        """
+        results: List[Optional[str]] = [None] * len(blocks)
+        pending: List[int] = []
+        cache_keys: Dict[int, str] = {}
+
+        for index, (code, language) in enumerate(blocks):
+            if self.highlight_cache is not None:
+                cache_keys[index] = self._highlight_key(code, language)
+                cached = self.highlight_cache.get(cache_keys[index])
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            pending.append(index)
+
+        options = self._lexer_options()
+        pending_size = sum(len(blocks[index][0]) for index in pending)
+        if (
+            self.config.get("parallel_highlight")
+            and len(pending) > 1
+            and pending_size >= self.config["parallel_highlight_threshold"]
+        ):
+            workers = self.config.get("highlight_workers") or os.cpu_count() or 1
+            tasks = [
+                (blocks[index][0], blocks[index][1], self.code_style, options)
+                for index in pending
+            ]
+            chunksize = max(1, len(tasks) // (workers * 4))
+            highlighted = self._get_highlight_executor(workers).map(
+                _highlight_task, tasks, chunksize=chunksize
+            )
+        else:
+            highlighted = (
+                highlight_source(blocks[index][0], blocks[index][1], self.code_style, options)
+                for index in pending
+            )
+
+        for index, html in zip(pending, highlighted):
+            results[index] = html
+            if index in cache_keys:
+                self.highlight_cache.put(cache_keys[index], html)
+
+        return results
+
+    def _get_highlight_executor(self, workers: int) -> "ProcessPoolExecutor":
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        if self._highlight_executor is None:
+            # Без fork: к этому моменту уже работают потоки браузера и
+            # фонового рендеринга диаграмм, а копия их блокировок в дочернем
+            # процессе может его заблокировать
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            self._highlight_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=context
+            )
+        return self._highlight_executor
+
+    def process_code_blocks(self, content: str) -> str:
+        """
+        Обрабатывает все блоки кода в Markdown, добавляя подсветку синтаксиса
+
+        Mermaid блоки остаются без изменений. Блоки с отступом (внутри
+        элементов списка) тоже остаются Markdown: HTML в начале строки
+        завершил бы список.
+        """
+        segments = split_fenced_blocks(content)
+        highlighted = iter(
+            self.highlight_code_blocks(
+                [
+                    (segment.code, segment.language)
+                    for segment in segments
+                    if isinstance(segment, FencedBlock)
+                    and not segment.is_mermaid
+                    and not segment.indent
+                ]
+            )
+        )
+
+        parts = []
+        for segment in segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif segment.is_mermaid or segment.indent:
+                parts.append(segment.source)
+            else:
+                parts.append(next(highlighted))
+        return "".join(parts)
+
+    @property
+    def kroki_client(self) -> KrokiClient:
+        """HTTP клиент онлайн-рендеринга, создаётся при первом обращении"""
+        if self._kroki_client is None:
+            self._kroki_client = KrokiClient(
+                base_url=self.config["kroki_url"],
+                max_workers=self.config["online_workers"],
+                timeout=self.config["online_timeout"],
+                retries=self.config["online_retries"],
+            )
+        return self._kroki_client
+
+    # Префикс путей диаграмм, которые хранятся только в памяти конвертера
+    MEMORY_PREFIX = "memory:"
+
+    def _store_diagram(self, cache_key: Optional[str], suffix: str, data: bytes) -> str:
+        """
+        Сохраняет отрендеренную диаграмму и возвращает её путь
+
+        Диаграмма попадает в кэш на диске, а без кэша (или если она больше
+        лимита кэша) - в память (путь вида
+        "memory:mermaid_N.svg"). Файл во временном каталоге пишется только
+        когда он действительно нужен: при отладке (debug_dir) или когда
+        диаграмма подключается ссылкой, а не встраивается (embed_images).
+        """
+        if cache_key:
+            cached = self.mermaid_cache.put_bytes(cache_key, suffix, data)
+            if cached is not None:
+                return str(cached)
+        name = f"mermaid_{self.mermaid_counter}{suffix}"
+        self.mermaid_counter += 1
+        if self.config.get("embed_images") and not self.config.get("debug_dir"):
+            self._memory_diagrams[name] = data
+            return self.MEMORY_PREFIX + name
+        diagram_file = self.temp_dir / name
+        diagram_file.write_bytes(data)
+        return str(diagram_file)
+
+    def _read_diagram(self, diagram_path: str) -> bytes:
+        """Читает диаграмму, сохранённую через _store_diagram()"""
+        if diagram_path.startswith(self.MEMORY_PREFIX):
+            return self._memory_diagrams[diagram_path[len(self.MEMORY_PREFIX) :]]
+        return Path(diagram_path).read_bytes()
+
+    def _store_online_svg(self, cache_key: Optional[str], svg: str) -> str:
+        """Сохраняет SVG от онлайн сервиса"""
+        return self._store_diagram(cache_key, ".svg", svg.encode("utf-8"))
+
+    def render_mermaid_online(self, diagram_code: str) -> Optional[str]:
+        """Рендерит Mermaid диаграмму через онлайн сервис"""
+        return self.render_mermaid_online_many([diagram_code])[0]
+
+    def render_mermaid_online_many(self, diagrams: List[str]) -> List[Optional[str]]:
+        """
+        Рендерит набор Mermaid диаграмм через онлайн сервис параллельно
+
+        Args:
+            diagrams: Исходный код диаграмм
+
+        Returns:
+            Пути к SVG файлам в порядке входных диаграмм (None при ошибке)
+        """
+        results: List[Optional[str]] = [None] * len(diagrams)
+        pending: Dict[str, List[int]] = {}
+        cache_keys: Dict[str, Optional[str]] = {}
+
+        for index, diagram_code in enumerate(diagrams):
+            if diagram_code in pending:
+                pending[diagram_code].append(index)
+                continue
+            cache_key, cached = self._cached_diagram("online", "svg", diagram_code)
+            if cached:
+                results[index] = str(cached)
+            else:
+                pending[diagram_code] = [index]
+                cache_keys[diagram_code] = cache_key
+
+        codes = list(pending)
+        for diagram_code, svg in zip(codes, self.kroki_client.render_many(codes)):
+            if isinstance(svg, Exception):
+                print(f"Ошибка при рендеринге диаграммы: {svg}")
+                continue
+            path = self._store_online_svg(cache_keys[diagram_code], svg)
+            for index in pending[diagram_code]:
+                results[index] = path
+
+        return results
+
+    @property
+    def browser_pool(self) -> BrowserPool:
+        """Пул Chromium, создаётся при первом обращении"""
+        if self._browser_pool is None:
+            self._browser_pool = BrowserPool()
+        return self._browser_pool
+
+    def _wait_for_page(self, page, ready_expression: Optional[str] = None) -> None:
+        """
+        Ожидает готовности загруженной страницы
+
+        В режиме "ready" ждёт выполнения ready_expression (например,
+        завершения рендеринга Mermaid), загрузки шрифтов и, при включённом
+        wait_network_idle, отсутствия сетевой активности - но не дольше
+        render_timeout. В режиме "fixed" выдерживает паузу fixed_wait.
+
+        Raises:
+            TimeoutError: если страница не стала готовой за render_timeout
+        """
+        if self.config.get("wait_mode") == "fixed":
+            page.wait_for_timeout(self.config["fixed_wait"])
+            return
+
+        deadline = time.monotonic() + self.config["render_timeout"] / 1000
+
+        def remaining() -> float:
+            left = (deadline - time.monotonic()) * 1000
+            if left <= 0:
+                raise TimeoutError(
+                    f"страница не готова за {self.config['render_timeout']} мс"
+                )
+            return left
+
+        try:
+            if self.config.get("wait_network_idle"):
+                page.wait_for_load_state("networkidle", timeout=remaining())
+            if ready_expression:
+                page.wait_for_function(ready_expression, timeout=remaining())
+            page.wait_for_function(
+                "document.fonts.status === 'loaded'", timeout=remaining()
+            )
+        except TimeoutError:
+            raise
+        except Exception as e:
+            # Playwright сообщает о таймауте собственным исключением
+            if "Timeout" in type(e).__name__:
+                raise TimeoutError(str(e)) from e
+            raise
+
+    # Рендерит диаграмму в SVG через mermaid.render() (Mermaid 9 и 10+).
+    # id зависит от кода диаграммы: стили внутри SVG ограничены этим id,
+    # и диаграммы из кэша разных запусков не должны пересекаться в документе
+    _MERMAID_RENDER_JS = """
+    async ([id, code, timeout]) => {
+        const timer = new Promise((_, reject) =>
+            setTimeout(() => reject(new Error("таймаут рендеринга Mermaid")), timeout));
+        try {
+            const result = await Promise.race([mermaid.render(id, code), timer]);
+            return typeof result === "string" ? result : result.svg;
+        } finally {
+            for (const stale of [id, "d" + id]) {
+                const node = document.getElementById(stale);
+                if (node) node.remove();
+            }
+        }
+    }
+    """
+
+    @property
+    def mermaid_script(self) -> Dict[str, str]:
+        """Источник Mermaid для локального рендеринга (см. resolve_mermaid_script)"""
+        if self._mermaid_script is None:
+            self._mermaid_script = resolve_mermaid_script(self.config.get("mermaid_js"))
+            if "url" in self._mermaid_script:
+                self._log(f"🌐 Mermaid загружается из {self._mermaid_script['url']}")
+        return self._mermaid_script
+
+    def _render_mermaid_svg(self, diagram_code: str, script: Dict[str, str]) -> str:
+        """Рендерит диаграмму в SVG текст на странице с загруженным Mermaid"""
+        page = self.browser_pool.mermaid_page(script)
+        return page.evaluate(
+            self._MERMAID_RENDER_JS,
+            [
+                self.diagram_id(diagram_code) + "-svg",
+                diagram_code,
+                self.config["render_timeout"],
+            ],
+        )
+
+    def _screenshot_mermaid(self, diagram_code: str, script: Dict[str, str]) -> bytes:
+        """Рендерит диаграмму на странице Mermaid и возвращает снимок в PNG"""
+        svg = self._render_mermaid_svg(diagram_code, script)
+        page = self.browser_pool.mermaid_page(script)
+        page.evaluate(
+            "svg => { document.body.innerHTML = '<div class=\"mermaid\">' + svg + '</div>'; }",
+            svg,
+        )
+        self._wait_for_page(page)
+        return page.locator(".mermaid").screenshot()
+
+    def render_mermaid_local(self, diagram_code: str) -> Optional[str]:
+        """
+        Рендерит Mermaid диаграмму локально через Playwright
+
+        По умолчанию (mermaid_output="svg") диаграмма рендерится в SVG
+        текст через mermaid.render() на переиспользуемой странице. При
+        mermaid_output="png" делается снимок элемента. Промежуточные файлы
+        не создаются, результат сохраняется через _store_diagram().
+        Рендеринг выполняется в потоке браузера (BrowserPool.call).
+        """
+        return self.browser_pool.call(self._render_mermaid_local, diagram_code)
+
+    def _render_mermaid_local(self, diagram_code: str) -> Optional[str]:
+        raster = self.config.get("mermaid_output") == "png"
+        output_type = (self.config.get("image_format") or "png") if raster else "svg"
+        cache_key, cached = self._cached_diagram("local", output_type, diagram_code)
+        if cached:
+            return str(cached)
+
+        # Ошибка в настройке mermaid_js должна дойти до пользователя
+        script = self.mermaid_script
+        try:
+            if raster:
+                data = self._optimize_diagram(
+                    self._screenshot_mermaid(diagram_code, script), output_type
+                )
+            else:
+                data = self._render_mermaid_svg(diagram_code, script).encode("utf-8")
+            return self._store_diagram(cache_key, f".{output_type}", data)
+        except MissingDependencyError:
+            raise
+        except Exception as e:
+            print(f"Ошибка при локальном рендеринге: {e}")
+            return None
+
+    def _optimize_diagram(self, png_data: bytes, image_format: str) -> bytes:
+        """Пережимает PNG диаграммы (или переводит в WebP) при наличии Pillow"""
+        if image_format == "png" and not self.config.get("optimize_images"):
+            return png_data
+        try:
+            return optimize_raster(
+                png_data, image_format, quality=self.config.get("image_quality", 90)
+            )
+        except MissingDependencyError:
+            # Для WebP Pillow обязателен, оптимизация PNG - по возможности
+            if image_format != "png":
+                raise
+            if not self._pillow_missing:
+                self._pillow_missing = True
+                self._log("ℹ️ Pillow не установлен, PNG диаграммы не оптимизируются")
+            return png_data
+
+    @staticmethod
+    def diagram_id(diagram_code: str) -> str:
+        """Идентификатор диаграммы в документе (по её исходному коду)"""
+        return "mmd-" + hashlib.sha256(diagram_code.encode("utf-8")).hexdigest()[:12]
+
+    def format_mermaid_for_html(
+        self, diagram_path: str, diagram_id: Optional[str] = None
+    ) -> str:
+        """Форматирует Mermaid диаграмму для HTML"""
+        id_attr = f' id="{diagram_id}"' if diagram_id else ""
+        if self.config.get("embed_images"):
+            # Встраиваем SVG напрямую
+            if diagram_path.endswith(".svg"):
+                svg_content = self._read_diagram(diagram_path).decode("utf-8")
+                if self.config.get("minify_svg"):
+                    svg_content = minify_svg(svg_content)
+                if diagram_id:
+                    # Повторы ссылаются на корневой элемент через <use>
+                    svg_content = svg_with_id(svg_content, f"{diagram_id}-svg")
+                return f'<div class="mermaid-diagram"{id_attr}>{svg_content}</div>'
+            else:
+                # Растровые форматы встраиваем через base64
+                mime = _IMAGE_MIME.get(Path(diagram_path).suffix.lower(), "image/png")
+                if diagram_path.startswith(self.MEMORY_PREFIX):
+                    img_base64 = base64.b64encode(
+                        self._read_diagram(diagram_path)
+                    ).decode("ascii")
+                else:
+                    img_base64 = base64_file(diagram_path)
+                return f'<div class="mermaid-diagram"{id_attr}><img src="data:{mime};base64,{img_base64}" alt="Mermaid Diagram"/></div>'
+        else:
+            file_path = Path(diagram_path).absolute()
+            return f'<div class="mermaid-diagram"{id_attr}><img src="file:///{file_path}" alt="Mermaid Diagram"/></div>'
+
+    # Копирует содержимое встроенной диаграммы во все места, где она повторяется
+    _DIAGRAM_REF_SCRIPT = (
+        "<script>document.querySelectorAll('[data-mermaid-ref]').forEach(function(e)"
+        "{var s=document.getElementById(e.getAttribute('data-mermaid-ref'));"
+        "if(s&&!e.firstChild){e.innerHTML=s.innerHTML;}});</script>"
+    )
+
+    def _embed_diagram(self, diagram_code: str, diagram_path: str) -> Tuple[str, bool]:
+        """
+        Возвращает (html, is_ref) для диаграммы
+
+        Встроенная диаграмма (embed_images) попадает в документ один раз.
+        Повтор SVG диаграммы - ссылка <svg><use>, которой не нужны скрипты.
+        Повтор растровой диаграммы в полном документе - пустая ссылка
+        data-mermaid-ref, которую заполняет _DIAGRAM_REF_SCRIPT; фрагмент
+        (standalone=False) может попасть туда, где скрипты не выполняются,
+        поэтому в нём растровые повторы встраиваются целиком. SVG, для
+        которого не построить ссылку, тоже повторяется целиком: копия через
+        скрипт продублировала бы идентификаторы внутри документа.
+        """
+        if self._asset_dir is not None:
+            return self._diagram_asset_html(diagram_path), False
+        if not self.config.get("embed_images"):
+            return self.format_mermaid_for_html(diagram_path), False
+        diagram_id = self.diagram_id(diagram_code)
+        if self._reference_repeats and diagram_id in self._embedded_diagrams:
+            reference = self._embedded_diagrams[diagram_id]
+            if reference:
+                return f'<div class="mermaid-diagram">{reference}</div>', False
+            if self.config.get("standalone") and not diagram_path.endswith(".svg"):
+                return (
+                    f'<div class="mermaid-diagram" data-mermaid-ref="{diagram_id}"></div>',
+                    True,
+                )
+            return self.format_mermaid_for_html(diagram_path), False
+        diagram_html = self.format_mermaid_for_html(diagram_path, diagram_id)
+        reference = None
+        if diagram_path.endswith(".svg"):
+            reference = svg_reference(diagram_html, f"{diagram_id}-svg")
+        self._embedded_diagrams[diagram_id] = reference or ""
+        return diagram_html, False
+
+    def _diagram_asset_html(self, diagram_path: str) -> str:
+        """
+        Выносит диаграмму в отдельный файл и возвращает ленивую ссылку на него
+
+        Файл называется по хэшу содержимого (write_asset), поэтому повторы и
+        неизменённые при пересборке диаграммы не записываются заново.
+        Размеры SVG указываются явно, чтобы отложенная загрузка не сдвигала
+        страницу.
+        """
+        data = self._read_diagram(diagram_path)
+        suffix = Path(diagram_path).suffix.lower()
+        size_attrs = ""
+        if suffix == ".svg":
+            svg_content = data.decode("utf-8")
+            if self.config.get("minify_svg"):
+                svg_content = minify_svg(svg_content)
+                data = svg_content.encode("utf-8")
+            size = svg_size(svg_content)
+            if size:
+                size_attrs = f' width="{size[0]}" height="{size[1]}"'
+        asset_file = write_asset(self._asset_dir, data, suffix)
+        src = Path(
+            os.path.relpath(asset_file.resolve(), self.output_file.parent.resolve())
+        ).as_posix()
+        return (
+            f'<div class="mermaid-diagram"><img src="{src}"{size_attrs} '
+            f'loading="lazy" decoding="async" alt="Mermaid Diagram"/></div>'
+        )
+
+    def process_markdown(self, content: str, use_online: bool = False) -> str:
+        """Обрабатывает Markdown, заменяя Mermaid диаграммы и подсвечивая код"""
+        processed, pending = self._prepare_markdown(
+            content, use_online, stash_indented=False
+        )
+        return self._splice_diagrams(processed, pending)
+
+    def _prepare_markdown(
+        self, content: str, use_online: bool = False, stash_indented: bool = True
+    ) -> Tuple[str, "_PendingDiagrams"]:
+        """
+        Подсвечивает код и запускает фоновый рендеринг диаграмм
+
+        Уникальные диаграммы собираются заранее и рендерятся в фоне (в
+        потоке браузера или, для онлайн сервиса, в отдельном потоке), пока
+        вызывающий код подсвечивает блоки и конвертирует Markdown. Вместо
+        диаграмм в тексте остаются метки, которые _splice_diagrams()
+        заменяет готовым HTML - как в Markdown, так и в итоговом HTML.
+
+        Блоки с отступом (внутри элементов списка) тоже заменяются метками
+        с тем же отступом: HTML в начале строки завершил бы список. При
+        stash_indented=False (результат - Markdown, а не HTML) такие блоки
+        остаются как есть.
+
+        Returns:
+            (Markdown с метками диаграмм, ожидающие диаграммы)
+        """
+        profiler = self.profiler
+        profiler.count("chars", len(content))
+
+        # Один проход по документу: находим все блоки кода
+        with profiler.stage("parse"):
+            segments = split_fenced_blocks(content)
+            blocks = [
+                segment
+                for segment in segments
+                if isinstance(segment, FencedBlock)
+                and (stash_indented or not segment.indent)
+            ]
+            code_blocks = [
+                (block.code, block.language) for block in blocks if not block.is_mermaid
+            ]
+            mermaid_blocks = [block.code for block in blocks if block.is_mermaid]
+        profiler.count("code_blocks", len(code_blocks))
+        profiler.count("diagrams", len(mermaid_blocks))
+
+        # Уникальные диаграммы уходят в фон до начала подсветки
+        diagrams = list(dict.fromkeys(mermaid_blocks))
+        profiler.count("unique_diagrams", len(diagrams))
+        future = self._schedule_diagrams(diagrams, use_online) if diagrams else None
+
+        # Подсвечиваем все блоки кода разом
+        with profiler.stage("highlight"):
+            highlighted = iter(self.highlight_code_blocks(code_blocks))
+
+        parts = []
+        stashed: List[str] = []
+        slot = 0
+        for segment in segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif segment.indent and not stash_indented:
+                parts.append(segment.source)
+            elif segment.is_mermaid:
+                parts.append(f"\n\n{segment.indent}{self._slot_prefix}d{slot}\n\n")
+                slot += 1
+            elif segment.indent:
+                stashed.append(next(highlighted))
+                parts.append(
+                    f"{segment.indent}{self._slot_prefix}c{len(stashed) - 1}"
+                )
+            else:
+                parts.append(next(highlighted))
+
+        return "".join(parts), _PendingDiagrams(mermaid_blocks, future, stashed)
+
+    def _schedule_diagrams(self, diagrams: List[str], use_online: bool):
+        """Ставит рендеринг диаграмм в фон и возвращает Future со словарём код -> путь"""
+        if use_online:
+            if self._diagram_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._diagram_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="md-diagrams"
+                )
+            return self._diagram_executor.submit(self._render_diagrams, diagrams, True)
+        # Локальный рендеринг идёт в потоке браузера, вызов из него - напрямую
+        return self.browser_pool.submit(self._render_diagrams, diagrams, False)
+
+    def _render_diagrams(
+        self, diagrams: List[str], use_online: bool
+    ) -> Dict[str, Optional[str]]:
+        start = time.perf_counter()
+        if use_online:
+            image_paths = self.render_mermaid_online_many(diagrams)
+        else:
+            image_paths = [self._render_mermaid_local(code) for code in diagrams]
+        self.profiler.count(
+            "mermaid_render_ms", int((time.perf_counter() - start) * 1000)
+        )
+        return dict(zip(diagrams, image_paths))
+
+    def _splice_diagrams(self, text: str, pending: "_PendingDiagrams") -> str:
+        """Дожидается фонового рендеринга и подставляет диаграммы и блоки вместо меток"""
+        if pending.future is None and not pending.blocks:
+            return text
+        rendered: Dict[str, Optional[str]] = {}
+        if pending.future is not None:
+            # Время ожидания диаграмм, не перекрытое подсветкой и Markdown
+            with self.profiler.stage("mermaid"):
+                rendered = pending.future.result()
+
+        has_refs = False
+
+        def replace(match: "re.Match") -> str:
+            nonlocal has_refs
+            index = int(match.group("index"))
+            if match.group("kind") == "c":
+                return pending.blocks[index]
+            code = pending.codes[index]
+            image_path = rendered.get(code)
+            if not image_path:
+                return f"<pre><code>{escape_html(code)}</code></pre>"
+            diagram_html, is_ref = self._embed_diagram(code, image_path)
+            has_refs = has_refs or is_ref
+            return diagram_html
+
+        # Метка - отдельный абзац (<p>...</p>) или часть абзаца элемента списка
+        result = re.sub(
+            rf"(?P<p><p>)?{self._slot_prefix}(?P<kind>[cd])(?P<index>\d+)(?(p)</p>)",
+            replace,
+            text,
+        )
+        if has_refs:
+            result += f"\n\n{self._DIAGRAM_REF_SCRIPT}\n"
+        return result
+
+    def markdown_to_html(self, content: str) -> str:
+        """Конвертирует обработанный Markdown в HTML"""
+        engine = get_markdown_engine(tuple(self.markdown_extensions))
+        return engine.reset().convert(content)
+
+    def create_html_document(self, body_content: str) -> str:
+        """Создает полный HTML документ"""
+        if self.config.get("standalone"):
+            head, tail = self._document_frame()
+            return head + body_content + tail
+        else:
+            return body_content
+
+    @classmethod
+    def build_stylesheet(cls, theme: Theme, code_style: str) -> str:
+        """CSS темы и подсветки кода (вычисляется один раз на процесс)"""
+        key = (cls, theme, code_style)
+        css = _STYLESHEET_CACHE.get(key)
+        if css is None:
+            theme_css = cls.THEMES[theme]
+
+            # Получаем дополнительный CSS, если тема не минимальная
+            if theme != Theme.MINIMAL:
+                theme_css = cls.THEMES[Theme.DEFAULT] + "\n" + cls.THEMES[theme]
+
+            pygments_css = get_code_formatter(code_style).get_style_defs(".highlight")
+            css = _STYLESHEET_CACHE[key] = (
+                f"{theme_css}\n        \n"
+                f"        /* Pygments syntax highlighting */\n"
+                f"        {pygments_css}"
+            )
+        return css
+
+    def _external_stylesheet_href(self, css: str) -> Optional[str]:
+        """
+        Записывает общий файл стилей и возвращает ссылку на него
+
+        Используется при включённой настройке external_css для HTML вывода
+        и всегда при разбиении на страницы (split_pages):
+        файл называется по хэшу содержимого, поэтому все страницы с одной
+        темой и стилем ссылаются на один файл, а браузер может кэшировать его
+        навсегда. Возвращает None, если стили нужно встроить в документ.
+        """
+        if (
+            not (self.config.get("external_css") or self._asset_dir is not None)
+            or self.output_format != OutputFormat.HTML
+            or self.output_file is None
+        ):
+            return None
+
+        if self.config.get("minify"):
+            css = minify_css(css)
+        css_dir = Path(self.config.get("css_dir") or self.output_file.parent)
+        css_file = write_shared_stylesheet(
+            css_dir, css, precompress=self.config.get("precompress") or ()
+        )
+        href = os.path.relpath(css_file.resolve(), self.output_file.parent.resolve())
+        return Path(href).as_posix()
+
+    def _document_title(self) -> str:
+        title = self.config.get("title")
+        if not title:
+            stem = self.input_file.stem if self.input_file else "document"
+            title = stem.replace("_", " ").title()
+        return title
+
+    def _document_frame(self, title: Optional[str] = None) -> Tuple[str, str]:
+        """Части HTML документа до и после содержимого body"""
+        title = title or self._document_title()
+
+        css = self.build_stylesheet(self.theme, self.code_style)
+        if self._asset_dir is not None:
+            css = f"{css}\n{self.PAGE_NAV_CSS}"
+        href = self._external_stylesheet_href(css)
+        if href:
+            style_block = f'<link rel="stylesheet" href="{href}">'
+        else:
+            style_block = f"""<style>
+        {css}
+    </style>"""
+
+        head = f"""<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    {style_block}
+</head>
+<body>
+    """
+        tail = """
+</body>
+</html>"""
+        return head, tail
+
+    def minify_html(self, html_content: str) -> str:
+        """Минифицирует HTML"""
+        return minify_html(html_content)
+
+    def generate_html(self, use_online_mermaid: bool = False) -> str:
+        """
+        Генерирует HTML из Markdown
+        Это центральный метод, используемый как для HTML, так и для PDF
+
+        Returns:
+            Готовый HTML документ
+        """
+        self._log(f"📄 Обработка {self.input_file}...")
+        self._log(f"🎨 Стиль подсветки кода: {self.code_style}")
+        self._log(f"🎨 Тема оформления: {self.theme.value}")
+
+        # Читаем Markdown файл
+        with self.profiler.stage("read"):
+            content = self.input_file.read_text(encoding="utf-8")
+
+        return self.render_string(content, use_online_mermaid)
+
+    def render_body(self, content: str, use_online_mermaid: bool = False) -> str:
+        """Конвертирует Markdown текст в HTML содержимое <body> (без оформления)"""
+        # Обрабатываем код и Mermaid диаграммы
+        self._embedded_diagrams.clear()
+        self._log("🖌️ Подсветка синтаксиса кода...")
+        self._log("🎨 Рендеринг Mermaid диаграмм...")
+        processed_content, pending = self._prepare_markdown(
+            content, use_online=use_online_mermaid
+        )
+
+        # Конвертируем в HTML, пока диаграммы рендерятся в фоне
+        self._log("📝 Генерация HTML...")
+        with self.profiler.stage("markdown"):
+            html_body = self.markdown_to_html(processed_content)
+        html_body = self._splice_diagrams(html_body, pending)
+        # Диаграммы уже встроены: долгоживущий конвертер (сервис) не копит их
+        self._memory_diagrams.clear()
+        self._log_cache_stats()
+        return html_body
+
+    def render_string(self, content: str, use_online_mermaid: bool = False) -> str:
+        """
+        Конвертирует Markdown текст в HTML без обращения к файловой системе
+
+        Args:
+            content: Исходный Markdown
+            use_online_mermaid: Рендерить диаграммы через онлайн сервис
+
+        Returns:
+            Готовый HTML документ (или только body при standalone=False)
+        """
+        html_body = self.render_body(content, use_online_mermaid)
+
+        # Создаем финальный HTML документ
+        with self.profiler.stage("assemble"):
+            html_content = self.create_html_document(html_body)
+
+        # Минифицируем если нужно
+        if self.config.get("minify"):
+            self._log("📦 Минификация HTML...")
+            with self.profiler.stage("minify"):
+                html_content = self.minify_html(html_content)
+
+        return html_content
+
+    def _log_cache_stats(self) -> None:
+        if self.highlight_cache is not None:
+            stats = self.highlight_cache.stats
+            if stats["hits"]:
+                self._log(
+                    f"💾 Кэш подсветки: попаданий {stats['hits']}, "
+                    f"промахов {stats['misses']}"
+                )
+        if self.mermaid_cache is not None:
+            stats = self.mermaid_cache.stats
+            if stats["hits"] or stats["misses"]:
+                self._log(
+                    f"💾 Кэш диаграмм: попаданий {stats['hits']}, "
+                    f"промахов {stats['misses']}, вытеснено {stats['evictions']}"
+                )
+
+    def generate_html_stream(self, out: TextIO, use_online_mermaid: bool = False) -> None:
+        """
+        Генерирует HTML по частям, записывая результат в out по мере готовности
+
+        Входной файл читается построчно и делится на фрагменты по заголовкам
+        первого уровня (см. iter_markdown_sections), каждый фрагмент проходит
+        весь конвейер отдельно. Пиковое потребление памяти определяется
+        размером самого большого фрагмента, а не всего документа.
+
+        Ссылки и сноски Markdown разрешаются в пределах фрагмента, поэтому
+        определение сноски должно находиться в том же разделе, что и ссылка.
+        """
+        self._log(f"📄 Потоковая обработка {self.input_file}...")
+        minify = self.config.get("minify")
+        standalone = self.config.get("standalone")
+
+        profiler = self.profiler
+
+        with profiler.stage("assemble"):
+            head, tail = self._document_frame()
+        if standalone:
+            out.write(self.minify_html(head) if minify else head)
+
+        # Повторная диаграмма ссылается на встроенную в одном из прошлых фрагментов
+        self._embedded_diagrams.clear()
+
+        sections = 0
+        with self.input_file.open(encoding="utf-8") as source:
+            chunks = iter_markdown_sections(
+                source, max_chars=self.config["stream_chunk_chars"]
+            )
+            while True:
+                with profiler.stage("read"):
+                    section = next(chunks, None)
+                if section is None:
+                    break
+                processed, pending = self._prepare_markdown(
+                    section, use_online=use_online_mermaid
+                )
+                with profiler.stage("markdown"):
+                    html_chunk = self.markdown_to_html(processed)
+                html_chunk = self._splice_diagrams(html_chunk, pending)
+                self._memory_diagrams.clear()
+                if minify:
+                    with profiler.stage("minify"):
+                        html_chunk = self.minify_html(html_chunk)
+                with profiler.stage("write"):
+                    out.write(html_chunk)
+                    out.write("\n")
+                sections += 1
+
+        if standalone:
+            out.write(self.minify_html(tail) if minify else tail)
+        profiler.count("sections", sections)
+
+        self._log(f"📝 Обработано фрагментов: {sections}")
+        self._log_cache_stats()
+
+    def _write_html(self, path: Path, use_online_mermaid: bool = False) -> None:
+        """Записывает HTML в файл (потоково при включённой настройке streaming)"""
+        if not self.config.get("streaming"):
+            html_content = self.generate_html(use_online_mermaid)
+            with self.profiler.stage("write"):
+                path.write_text(html_content, encoding="utf-8")
+            return
+
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("w", encoding="utf-8") as out:
+                self.generate_html_stream(out, use_online_mermaid)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _write_pages(self, use_online_mermaid: bool = False) -> List[Path]:
+        """
+        Записывает документ набором связанных HTML страниц
+
+        Документ делится по заголовкам до уровня split_pages включительно
+        (split_html_sections). Выходной файл становится страницей оглавления,
+        страницы разделов пишутся рядом с ним (<имя>-001.html, ...) и
+        связаны ссылками назад/вперёд. Стили выносятся в общий файл, а
+        диаграммы - в каталог assets/ и загружаются лениво, поэтому открытие
+        страницы не зависит от размера всего документа. Ссылки на якоря
+        других страниц (оглавление --toc, сноски) переписываются.
+
+        Returns:
+            Пути всех записанных страниц, начиная со страницы оглавления
+        """
+        self._log(f"📄 Обработка {self.input_file} (по страницам)...")
+        with self.profiler.stage("read"):
+            content = self.input_file.read_text(encoding="utf-8")
+
+        self._asset_dir = self.output_file.parent / "assets"
+        try:
+            html_body = self.render_body(content, use_online_mermaid)
+            level = min(max(int(self.config["split_pages"]), 1), 6)
+            sections = split_html_sections(html_body, level=level)
+            document_title = self._document_title()
+            stem = self.output_file.stem
+            index_name = self.output_file.name
+            names = [f"{stem}-{number:03d}.html" for number in range(1, len(sections) + 1)]
+            titles = [title or document_title for title, _ in sections]
+
+            # Якорь -> страница, на которой он определён
+            anchors: Dict[str, str] = {}
+            for name, (_, chunk) in zip(names, sections):
+                for anchor in _ELEMENT_ID.findall(chunk):
+                    anchors.setdefault(anchor, name)
+
+            pages: List[Tuple[Path, str]] = []
+            with self.profiler.stage("assemble"):
+                index_items = []
+                for name, title, (_, chunk) in zip(names, titles, sections):
+                    heading = re.match(r"<h([1-6])", chunk)
+                    level = heading.group(1) if heading else "1"
+                    index_items.append(
+                        f'<li class="index-h{level}">'
+                        f'<a href="{name}">{escape_html(title)}</a></li>'
+                    )
+                head, tail = self._document_frame(document_title)
+                index_body = (
+                    f'<nav class="page-index">\n<h1>{escape_html(document_title)}</h1>\n'
+                    f"<ol>\n" + "\n".join(index_items) + "\n</ol>\n</nav>"
+                )
+                pages.append((self.output_file, head + index_body + tail))
+
+                for number, (name, title, (section_title, chunk)) in enumerate(
+                    zip(names, titles, sections)
+                ):
+
+                    def relink(match: "re.Match", name: str = name) -> str:
+                        target = anchors.get(match.group(1))
+                        if target is None or target == name:
+                            return match.group(0)
+                        return f'href="{target}#{match.group(1)}"'
+
+                    links = []
+                    if number > 0:
+                        links.append(
+                            f'<a href="{names[number - 1]}" rel="prev">'
+                            f"← {escape_html(titles[number - 1])}</a>"
+                        )
+                    links.append(f'<a href="{index_name}" rel="index">Содержание</a>')
+                    if number + 1 < len(names):
+                        links.append(
+                            f'<a href="{names[number + 1]}" rel="next">'
+                            f"{escape_html(titles[number + 1])} →</a>"
+                        )
+                    nav = '<nav class="page-nav">' + "".join(links) + "</nav>"
+
+                    page_title = document_title
+                    if section_title:
+                        page_title = f"{escape_html(section_title)} — {document_title}"
+                    head, tail = self._document_frame(page_title)
+                    page_body = _LOCAL_LINK.sub(relink, chunk)
+                    pages.append(
+                        (
+                            self.output_file.with_name(name),
+                            f"{head}{nav}\n{page_body}\n{nav}{tail}",
+                        )
+                    )
+        finally:
+            self._asset_dir = None
+
+        minify = self.config.get("minify")
+        if minify:
+            with self.profiler.stage("minify"):
+                pages = [(path, self.minify_html(page)) for path, page in pages]
+        with self.profiler.stage("write"):
+            for path, page in pages:
+                path.write_text(page, encoding="utf-8")
+        self.profiler.count("pages", len(pages) - 1)
+        return [path for path, _ in pages]
+
+    def convert_to_html(self, use_online_mermaid: bool = False) -> bool:
+        """Конвертирует Markdown в HTML файл (или набор страниц при split_pages)"""
+        # Генерируем и сохраняем результат
+        if self.config.get("split_pages"):
+            written = self._write_pages(use_online_mermaid)
+            self._log(
+                f"✅ HTML успешно создан: {self.output_file} "
+                f"(страниц: {len(written) - 1})"
+            )
+        else:
+            self._write_html(self.output_file, use_online_mermaid)
+            written = [self.output_file]
+            self._log(f"✅ HTML успешно создан: {self.output_file}")
+        self._show_file_size()
+
+        precompress = self.config.get("precompress")
+        if precompress:
+            for written_file in written:
+                for path in write_precompressed(written_file, precompress):
+                    self._log(f"🗜️ Сжатая копия: {path}")
+        return True
+
+    def _load_document(self, page, html_content: str) -> None:
+        """
+        Загружает HTML документ в страницу
+
+        Документ передаётся в страницу напрямую, без записи на диск. Файл
+        пишется во временный каталог, только если документ ссылается на
+        локальные файлы (file:///, при отключённом embed_images) - иначе
+        Chromium не даст их загрузить - или при отладке (debug_dir).
+        """
+        if "file:///" in html_content or self.config.get("debug_dir"):
+            html_file = self.temp_dir / "document.html"
+            html_file.write_text(html_content, encoding="utf-8")
+            page.goto(html_file.absolute().as_uri())
+        else:
+            page.set_content(html_content)
+
+    def _pdf_options(self) -> Dict[str, Any]:
+        """Параметры печати PDF (с номерами страниц при pdf_page_numbers)"""
+        return pdf_print_options(self.config)
+
+    def render_pdf_sections(self, html_body: str) -> bytes:
+        """
+        Печатает документ в PDF по разделам и склеивает результат
+
+        Содержимое делится по заголовкам первого уровня (split_html_sections),
+        разделы объединяются до pdf_section_chars символов и печатаются по
+        очереди в браузере пула (browser_pool) - Chromium не раскладывает
+        весь огромный документ разом, и второй браузер не запускается.
+        Закладки разделов переносятся в общее оглавление PDF, номера страниц
+        (pdf_page_numbers) проставляются сквозные после склейки.
+
+        Args:
+            html_body: Содержимое <body> из render_body()
+
+        Returns:
+            Содержимое PDF файла
+        """
+        import io
+
+        pypdf = _require("pypdf", "pypdf", "объединения разделов PDF")
+
+        sections = split_html_sections(
+            html_body, min_chars=self.config["pdf_section_chars"]
+        )
+        self._log(f"📑 Печать PDF по разделам: {len(sections)}")
+        minify = self.config.get("minify")
+        options = dict(PDF_OPTIONS, outline=True)
+        writer = pypdf.PdfWriter()
+        for title, section_body in sections:
+            # В памяти одновременно только документ текущего раздела
+            document = self.create_html_document(section_body)
+            if minify:
+                document = self.minify_html(document)
+            section_pdf = self.browser_pool.call(self._print_page, document, None, options)
+            reader = pypdf.PdfReader(io.BytesIO(section_pdf))
+            if reader.outline:
+                writer.append(reader, import_outline=True)
+            else:
+                # Chromium без поддержки outline - закладка на начало раздела
+                writer.append(reader, outline_item=title or None, import_outline=False)
+
+        if self.config.get("pdf_page_numbers"):
+            self._stamp_page_numbers(writer)
+
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def _stamp_page_numbers(self, writer) -> None:
+        """Накладывает сквозные номера страниц на склеенный PDF"""
+        import io
+
+        pypdf = _require("pypdf", "pypdf", "объединения разделов PDF")
+
+        total = len(writer.pages)
+        # Пустые страницы того же формата: Chromium печатает на них только
+        # колонтитул с номером, фон прозрачный
+        blank_pages = '<div class="page"></div>' * total
+        overlay_html = (
+            "<!DOCTYPE html><html><head><style>"
+            ".page { height: 1px; break-after: page; } .page:last-child { break-after: auto; }"
+            f"</style></head><body>{blank_pages}</body></html>"
+        )
+        options = dict(PDF_OPTIONS, print_background=False, **PAGE_NUMBER_OPTIONS)
+        overlay_pdf = self.browser_pool.call(self._print_page, overlay_html, None, options)
+        overlay = pypdf.PdfReader(io.BytesIO(overlay_pdf))
+        for page, number_page in zip(writer.pages, overlay.pages):
+            page.merge_page(number_page)
+
+    def render_pdf(
+        self, html_content: Optional[str] = None, html_file: Optional[Path] = None
+    ) -> bytes:
+        """
+        Печатает HTML документ в PDF
+
+        Args:
+            html_content: Готовый HTML документ
+            html_file: Либо путь к уже записанному HTML (потоковый режим)
+
+        Returns:
+            Содержимое PDF файла
+        """
+        return self.browser_pool.call(self._print_page, html_content, html_file)
+
+    def _print_page(
+        self,
+        html_content: Optional[str],
+        html_file: Optional[Path],
+        pdf_options: Optional[Dict[str, Any]] = None,
+    ) -> bytes:
+        """Печать в PDF (выполняется в потоке браузера)"""
+        page = self.browser_pool.new_page()
+        try:
+            if html_file is not None:
+                page.goto(Path(html_file).absolute().as_uri())
+            else:
+                self._load_document(page, html_content)
+            try:
+                self._wait_for_page(page)
+            except TimeoutError as e:
+                # Печатаем то, что успело загрузиться, а не прерываем конвертацию
+                print(f"⚠️ Страница не дождалась готовности: {e}")
+
+            # Генерируем PDF
+            return page.pdf(**(pdf_options or self._pdf_options()))
+        finally:
+            page.close()
+
+    def convert_to_pdf(
+        self, use_online_mermaid: bool = False, return_bytes: bool = False
+    ) -> Union[bool, bytes]:
+        """
+        Конвертирует Markdown в PDF через HTML
+
+        HTML не записывается на диск (кроме потокового режима, где документ
+        слишком велик, чтобы держать его в памяти целиком).
+
+        Args:
+            use_online_mermaid: Рендерить диаграммы через онлайн сервис
+            return_bytes: Вернуть содержимое PDF вместо записи в output_file
+                (ошибки в этом случае пробрасываются вызывающему коду)
+
+        Returns:
+            Успех конвертации или содержимое PDF при return_bytes
+        """
+        html_content = html_file = html_body = None
+        if self.config.get("pdf_sections"):
+            with self.profiler.stage("read"):
+                content = self.input_file.read_text(encoding="utf-8")
+            # Разделы печатаются отдельно: повторные диаграммы встраиваются целиком
+            self._reference_repeats = False
+            try:
+                html_body = self.render_body(content, use_online_mermaid)
+            finally:
+                self._reference_repeats = True
+        elif self.config.get("streaming"):
+            html_file = self.temp_dir / "document.html"
+            self._write_html(html_file, use_online_mermaid)
+        else:
+            html_content = self.generate_html(use_online_mermaid)
+
+        self._log("📑 Генерация PDF...")
+
+        try:
+            with self.profiler.stage("pdf"):
+                if html_body is not None:
+                    pdf_data = self.render_pdf_sections(html_body)
+                else:
+                    pdf_data = self.render_pdf(html_content, html_file)
+            if return_bytes:
+                return pdf_data
+            with self.profiler.stage("write"):
+                self.output_file.write_bytes(pdf_data)
+            self._log(f"✅ PDF успешно создан: {self.output_file}")
+            self._show_file_size()
+            return True
+
+        except Exception as e:
+            if (
+                return_bytes
+                or self.config.get("raise_errors")
+                or isinstance(e, MissingDependencyError)
+            ):
+                raise
+            print(f"❌ Ошибка при создании PDF: {e}")
+            print("Попробуйте установить Chromium: playwright install chromium")
+            return False
+
+    def convert(self, use_online_mermaid: bool = False) -> None:
+        """
+        Универсальный метод конвертации
+        Выбирает нужный конвертер на основе output_format
+
+        При включённой настройке incremental пропускает конвертацию, если
+        входные данные не изменились с прошлой сборки (см. BuildManifest)
+        """
+        try:
+            manifest = fingerprint = None
+            if self.config.get("incremental"):
+                manifest = BuildManifest(self._manifest_path())
+                fingerprint = self.input_fingerprint(use_online_mermaid)
+                if manifest.is_fresh(self.output_file, fingerprint):
+                    self._log(f"⏭️ Без изменений, пропуск: {self.output_file}")
+                    return
+
+            if self.output_format == OutputFormat.HTML:
+                success = self.convert_to_html(use_online_mermaid)
+            elif self.output_format == OutputFormat.PDF:
+                success = self.convert_to_pdf(use_online_mermaid)
+            else:
+                raise ValueError(f"Неподдерживаемый формат: {self.output_format}")
+
+            if manifest is not None and success:
+                # Перечитываем манифест: его мог обновить параллельный процесс
+                manifest = BuildManifest(manifest.path)
+                manifest.record(self.output_file, fingerprint)
+                manifest.save()
+
+            if success:
+                self.report_profile()
+        finally:
+            # Очищаем временные файлы
+            self.cleanup()
+
+    def report_profile(self) -> None:
+        """Выводит замеры по этапам и записывает их в profile_json (если включено)"""
+        if not self.profiler.enabled:
+            return
+        print(f"⏱️ Профиль конвертации {self.input_file}:")
+        print(self.profiler.format_table())
+        profile_json = self.config.get("profile_json")
+        if profile_json:
+            self.profiler.write_json(
+                Path(profile_json),
+                input_file=str(self.input_file),
+                output_file=str(self.output_file),
+                output_format=self.output_format.value,
+                converter_version=_converter_version()[:12],
+            )
+            self._log(f"⏱️ Профиль записан: {profile_json}")
+
+    def cleanup(self) -> None:
+        """Очищает временные файлы и закрывает собственный браузер"""
+        import shutil
+
+        if self._highlight_executor is not None:
+            self._highlight_executor.shutdown()
+            self._highlight_executor = None
+
+        if self._diagram_executor is not None:
+            self._diagram_executor.shutdown()
+            self._diagram_executor = None
+
+        self.profiler.close()
+
+        if self._kroki_client is not None:
+            self._kroki_client.close()
+            self._kroki_client = None
+
+        if self._owns_browser_pool and self._browser_pool is not None:
+            self._browser_pool.close()
+            self._browser_pool = None
+
+        self._memory_diagrams.clear()
+        if self._temp_dir is not None:
+            # Каталог отладки (debug_dir) оставляем для изучения
+            if not self.config.get("debug_dir") and self._temp_dir.exists():
+                shutil.rmtree(self._temp_dir)
+            self._temp_dir = None
+
+    def __enter__(self) -> "UniversalMarkdownConverter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cleanup()
+
+    def _log(self, message: str) -> None:
+        """Выводит сообщение о ходе конвертации (если не включён тихий режим)"""
+        if self.config.get("verbose", True):
+            print(message)
+
+    def _show_file_size(self) -> None:
+        """Показывает размер созданного файла"""
+        file_size = self.output_file.stat().st_size
+        if file_size > 1024 * 1024:
+            size_str = f"{file_size / (1024 * 1024):.2f} MB"
+        else:
+            size_str = f"{file_size / 1024:.2f} KB"
+        self._log(f"📊 Размер файла: {size_str}")
+
+
+def convert_markdown_string(
+    content: str,
+    code_style: str = "monokai",
+    theme: Theme = Theme.DEFAULT,
+    config: Optional[Dict[str, Any]] = None,
+    use_online_mermaid: bool = False,
+    browser_pool: Optional[BrowserPool] = None,
+) -> str:
+    """
+    Конвертирует Markdown строку в HTML строку
+
+    Движок Markdown, лексеры, форматтеры и кэш подсветки живут на уровне
+    процесса, поэтому повторные вызовы не платят за их инициализацию.
+
+    Args:
+        content: Исходный Markdown
+        config: Настройки конвертера (title задаёт заголовок документа)
+        browser_pool: Общий пул Chromium для локального рендеринга диаграмм
+
+    Returns:
+        HTML документ
+    """
+    converter = UniversalMarkdownConverter(
+        code_style=code_style,
+        theme=theme,
+        config=dict(config or {}, verbose=False),
+        browser_pool=browser_pool,
+    )
+    try:
+        return converter.render_string(content, use_online_mermaid)
+    finally:
+        converter.cleanup()
+
+
+def convert_markdown_pdf(
+    content: str,
+    code_style: str = "monokai",
+    theme: Theme = Theme.DEFAULT,
+    config: Optional[Dict[str, Any]] = None,
+    use_online_mermaid: bool = False,
+    browser_pool: Optional[BrowserPool] = None,
+) -> bytes:
+    """
+    Конвертирует Markdown строку в PDF без промежуточных файлов
+
+    Args:
+        content: Исходный Markdown
+        config: Настройки конвертера (title задаёт заголовок документа)
+        browser_pool: Общий пул Chromium (иначе браузер запускается на вызов)
+
+    Returns:
+        Содержимое PDF файла
+    """
+    converter = UniversalMarkdownConverter(
+        output_format=OutputFormat.PDF,
+        code_style=code_style,
+        theme=theme,
+        config=dict(config or {}, verbose=False),
+        browser_pool=browser_pool,
+    )
+    try:
+        return converter.render_pdf(converter.render_string(content, use_online_mermaid))
+    finally:
+        converter.cleanup()
+
+
+# Параметры печати PDF (общие для конвертера и PdfBatchEngine)
+PDF_OPTIONS: Dict[str, Any] = {
+    "format": "A4",
+    "margin": {"top": "20mm", "right": "20mm", "bottom": "20mm", "left": "20mm"},
+    "print_background": True,
+}
+
+
+# Сквозные номера страниц в нижнем колонтитуле
+PAGE_NUMBER_OPTIONS: Dict[str, Any] = {
+    "display_header_footer": True,
+    "header_template": "<span></span>",
+    "footer_template": (
+        '<div style="width: 100%; font-size: 9px; color: #666; text-align: center;">'
+        '<span class="pageNumber"></span> / <span class="totalPages"></span></div>'
+    ),
+}
+
+
+def pdf_print_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметры page.pdf() по настройкам (с номерами страниц при pdf_page_numbers)"""
+    if not config.get("pdf_page_numbers"):
+        return PDF_OPTIONS
+    return dict(PDF_OPTIONS, **PAGE_NUMBER_OPTIONS)
+
+
+class PdfJob(NamedTuple):
+    """Документ для PdfBatchEngine: HTML строкой или файлом и путь к PDF"""
+
+    # None - PDF возвращается байтами (PdfBatchEngine.render_bytes)
+    output_file: Optional[Path]
+    html: Optional[str] = None
+    html_file: Optional[Path] = None
+    # Параметры page.pdf() (по умолчанию PDF_OPTIONS)
+    pdf_options: Optional[Dict[str, Any]] = None
+
+
+class PdfBatchEngine:
+    """
+    Параллельная печать HTML документов в PDF
+
+    Использует асинхронный API Playwright: один процесс Chromium на весь
+    пакет, каждый документ печатается в собственном контексте браузера
+    (изолированные cookies, кэш и хранилище), одновременно - не больше
+    concurrency документов. Ошибка одного документа не прерывает остальные.
+
+    Браузер запускается при первом render() и переиспользуется следующими
+    вызовами до close() (или выхода из блока with).
+    """
+
     def __init__(
         self,
-        input_file: str,
-        output_format: OutputFormat = OutputFormat.HTML,
-        output_file: Optional[str] = None,
-        code_style: str = "monokai",
-        theme: Theme = Theme.DEFAULT,
+        concurrency: int = 4,
+        headless: bool = True,
         config: Optional[Dict[str, Any]] = None,
     ):
         """
-        Инициализация конвертера
-
         Args:
-            input_file: Путь к входному Markdown файлу
-            output_format: Формат выходного файла
-            output_file: Путь к выходному файлу (если не указан, генерируется автоматически)
-            code_style: Стиль подсветки синтаксиса кода
-            theme: Тема оформления документа
-            config: Дополнительные настройки конвертера
+            concurrency: Максимум одновременно печатаемых документов
+            headless: Запускать браузер без окна
+            config: Настройки ожидания готовности страниц (wait_mode,
+                render_timeout, fixed_wait, wait_network_idle)
         """
-        self.input_file = Path(input_file)
-        self.output_format = output_format
-        self.output_file = (
-            Path(output_file) if output_file else self._generate_output_filename()
+        self.concurrency = max(1, concurrency)
+        self.headless = headless
+        self.config = UniversalMarkdownConverter.apply_config_defaults(dict(config or {}))
+        self._loop = None
+        self._playwright = None
+        self._browser = None
+
+    def render(self, jobs: List[PdfJob]) -> List[Tuple[float, Optional[str]]]:
+        """
+        Печатает документы и возвращает (секунды, ошибка или None) по каждому
+
+        Raises:
+            MissingDependencyError: если не установлен playwright
+        """
+        return [(seconds, error) for seconds, error, _ in self._run(jobs)]
+
+    def render_bytes(self, jobs: List[PdfJob]) -> List[bytes]:
+        """
+        Печатает документы и возвращает содержимое PDF по каждому
+
+        Raises:
+            RuntimeError: если не удалось напечатать хотя бы один документ
+        """
+        results = self._run(jobs)
+        for index, (_, error, _) in enumerate(results):
+            if error:
+                raise RuntimeError(f"документ {index + 1}: {error}")
+        return [data for _, _, data in results]
+
+    def _run(self, jobs: List[PdfJob]) -> List[Tuple[float, Optional[str], Optional[bytes]]]:
+        import asyncio
+
+        if not jobs:
+            return []
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self._render_all(jobs))
+
+    async def _render_all(
+        self, jobs: List[PdfJob]
+    ) -> List[Tuple[float, Optional[str], Optional[bytes]]]:
+        import asyncio
+
+        if self._browser is None:
+            async_api = _require(
+                "playwright.async_api",
+                "playwright",
+                "генерации PDF (после установки: playwright install chromium)",
+            )
+            self._playwright = await async_api.async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
+                headless=self.headless
+            )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(
+            *(self._render_one(self._browser, semaphore, job) for job in jobs)
         )
-        self.code_style = code_style
-        self.theme = theme
-        self.config = config or {}
 
-        # Настройки по умолчанию
-        self.config.setdefault("embed_images", True)
-        self.config.setdefault("standalone", True)
-        self.config.setdefault("minify", False)
-        self.config.setdefault("include_toc", False)
+    async def _render_one(
+        self, browser, semaphore, job: PdfJob
+    ) -> Tuple[float, Optional[str], Optional[bytes]]:
+        async with semaphore:
+            start = time.perf_counter()
+            context = None
+            try:
+                context = await browser.new_context()
+                page = await context.new_page()
+                if job.html_file is not None:
+                    await page.goto(Path(job.html_file).absolute().as_uri())
+                else:
+                    await page.set_content(job.html)
+                await self._wait_for_page(page)
+                options = job.pdf_options or PDF_OPTIONS
+                if job.output_file is None:
+                    data = await page.pdf(**options)
+                    return time.perf_counter() - start, None, data
+                await page.pdf(path=str(job.output_file), **options)
+                return time.perf_counter() - start, None, None
+            except Exception as e:
+                return time.perf_counter() - start, f"{type(e).__name__}: {e}", None
+            finally:
+                if context is not None:
+                    await context.close()
+
+    async def _close_browser(self) -> None:
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+        finally:
+            self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    def close(self) -> None:
+        """Закрывает браузер и цикл событий"""
+        if self._loop is None:
+            return
+        try:
+            self._loop.run_until_complete(self._close_browser())
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    def __enter__(self) -> "PdfBatchEngine":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    async def _wait_for_page(self, page) -> None:
+        """Асинхронный аналог UniversalMarkdownConverter._wait_for_page()"""
+        if self.config.get("wait_mode") == "fixed":
+            await page.wait_for_timeout(self.config["fixed_wait"])
+            return
+        timeout = self.config["render_timeout"]
+        try:
+            if self.config.get("wait_network_idle"):
+                await page.wait_for_load_state("networkidle", timeout=timeout)
+            await page.wait_for_function(
+                "document.fonts.status === 'loaded'", timeout=timeout
+            )
+        except Exception as e:
+            # Печатаем то, что успело загрузиться, как и одиночная конвертация
+            if "Timeout" not in type(e).__name__:
+                raise
+
+
+class BatchItemResult(NamedTuple):
+    """Результат конвертации одного файла в пакетном режиме"""
+
+    input_file: Path
+    output_file: Path
+    seconds: float
+    error: Optional[str]
+    # Промежуточный HTML, если PDF печатается отдельно (PdfBatchEngine)
+    html_file: Optional[Path] = None
+
+
+# Состояние процесса-воркера пакетной конвертации (живёт между файлами)
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_batch_worker(options: Dict[str, Any]) -> None:
+    """Инициализирует воркер: сохраняет настройки и создаёт общий браузер"""
+    import multiprocessing.util
+
+    browser_pool = BrowserPool()
+    _WORKER_STATE["options"] = options
+    _WORKER_STATE["browser_pool"] = browser_pool
+    # atexit не срабатывает в дочерних процессах multiprocessing
+    multiprocessing.util.Finalize(None, browser_pool.close, exitpriority=10)
 
-        # Временная директория для промежуточных файлов
-        self.temp_dir = Path(tempfile.mkdtemp())
-        self.mermaid_counter = 0
 
-        # Создаём форматтер для подсветки кода
-        self.code_formatter = HtmlFormatter(
-            style=code_style,
-            cssclass="highlight",
-            nowrap=False,
-            noclasses=False,
-            nobackground=False,
-            linenos=False,
+def _convert_batch_item(input_file: Path, output_file: Path) -> BatchItemResult:
+    """Конвертирует один файл в процессе-воркере"""
+    options = _WORKER_STATE["options"]
+    html_dir = options.get("pdf_html_dir")
+    start = time.perf_counter()
+    error = html_file = None
+    try:
+        config = dict(options["config"])
+        if html_dir:
+            # HTML печатается после cleanup() воркера: диаграммы из его
+            # временного каталога (или вытесненные из кэша) к этому моменту
+            # уже удалены, поэтому они встраиваются в документ
+            config["embed_images"] = True
+        converter = UniversalMarkdownConverter(
+            input_file=str(input_file),
+            output_format=options["output_format"],
+            output_file=str(output_file),
+            code_style=options["code_style"],
+            theme=options["theme"],
+            # Каждый воркер уже занимает ядро, вложенный пул не нужен
+            config=dict(
+                config,
+                verbose=False,
+                raise_errors=True,
+                parallel_highlight=False,
+                # Профиль пишется для одиночной конвертации, не для пакета
+                profile=False,
+                profile_json=None,
+                profile_memory=False,
+            ),
+            browser_pool=_WORKER_STATE["browser_pool"],
         )
+        if html_dir:
+            # PDF напечатает родительский процесс, воркер готовит только HTML
+            html_file = Path(html_dir) / f"{DiskCache.make_key(str(output_file))}.html"
+            try:
+                converter._write_html(html_file, options["use_online"])
+            finally:
+                converter.cleanup()
+        else:
+            converter.convert(use_online_mermaid=options["use_online"])
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        html_file = None
+    return BatchItemResult(
+        input_file, output_file, time.perf_counter() - start, error, html_file
+    )
 
-        # Расширения Markdown
-        self.markdown_extensions = [
-            "tables",
-            "fenced_code",
-            "nl2br",
-            "sane_lists",
-            "footnotes",
-            "attr_list",
-            "def_list",
-            "abbr",
-            "md_in_html",
-        ]
 
-        if self.config.get("include_toc"):
-            self.markdown_extensions.append("toc")
+def _print_batch_pdfs(
+    results: List[BatchItemResult], config: Dict[str, Any]
+) -> List[BatchItemResult]:
+    """Печатает подготовленный воркерами HTML в PDF (см. convert_batch)"""
+    ready = [result for result in results if not result.error]
+    concurrency = config.get("pdf_concurrency") or 4
+    print(f"📑 Печать PDF: {len(ready)} документов, одновременно: {concurrency}")
 
-    def _generate_output_filename(self) -> Path:
-        """Генерирует имя выходного файла на основе формата"""
-        extensions = {OutputFormat.HTML: ".html", OutputFormat.PDF: ".pdf"}
-        return self.input_file.with_suffix(extensions[self.output_format])
+    for result in ready:
+        result.output_file.parent.mkdir(parents=True, exist_ok=True)
+    options = pdf_print_options(config)
+    try:
+        with PdfBatchEngine(concurrency=concurrency, config=config) as engine:
+            rendered = engine.render(
+                [
+                    PdfJob(result.output_file, html_file=result.html_file, pdf_options=options)
+                    for result in ready
+                ]
+            )
+    except Exception as e:
+        # Браузер не запустился - ошибка общая для всех документов
+        reason = str(e).splitlines()[0] if str(e) else ""
+        rendered = [(0.0, f"{type(e).__name__}: {reason}")] * len(ready)
 
-    def escape_html(self, text: str) -> str:
-        """Экранирует HTML символы"""
-        return (
-            text.replace("&", "&amp;")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-            .replace('"', "&quot;")
-            .replace("'", "&#39;")
+    printed = {}
+    for result, (seconds, error) in zip(ready, rendered):
+        printed[result.output_file] = result._replace(
+            seconds=result.seconds + seconds, error=error
         )
+        status = "❌" if error else "✅"
+        print(f"{status} {result.seconds + seconds:7.2f} с  {result.input_file}")
+    return [printed.get(result.output_file, result) for result in results]
 
-    def highlight_code_block(self, code: str, language: Optional[str] = None) -> str:
-        """
-        Подсвечивает блок кода используя Pygments
 
-        Args:
-            code: Код для подсветки
-            language: Язык программирования
+def collect_inputs(patterns: List[str]) -> List[Tuple[Path, Path]]:
+    """
+    Собирает Markdown файлы для пакетной конвертации
 
-        Returns:
-            HTML с подсвеченным кодом
-        """
-        try:
-            if language:
-                try:
-                    lexer = get_lexer_by_name(language, stripall=True)
-                except Exception:
-                    lexer = guess_lexer(code)
-            else:
-                lexer = guess_lexer(code)
+    Args:
+        patterns: Файлы, каталоги (обходятся рекурсивно) или glob-шаблоны
 
-            return highlight(code, lexer, self.code_formatter)
-        except Exception:
-            return f'<pre class="highlight"><code>{self.escape_html(code)}</code></pre>'
+    Returns:
+        Список пар (файл, базовый каталог) без повторов; базовый каталог
+        определяет относительный путь файла в выходном каталоге
+    """
+    found: Dict[Path, Path] = {}
 
-    def process_code_blocks(self, content: str) -> str:
-        """Обрабатывает все блоки кода в Markdown, добавляя подсветку синтаксиса"""
-        # Сохраняем mermaid блоки
-        mermaid_blocks = []
-        mermaid_pattern = r"```mermaid\n(.*?)\n```"
+    for pattern in patterns:
+        path = Path(pattern)
+        if glob.has_magic(pattern):
+            # Базовый каталог - часть шаблона до первого спецсимвола
+            parts = []
+            for part in path.parts:
+                if glob.has_magic(part):
+                    break
+                parts.append(part)
+            base = Path(*parts) if parts else Path(".")
+            files = [Path(match) for match in glob.glob(pattern, recursive=True)]
+        elif path.is_dir():
+            base = path
+            files = path.rglob("*.md")
+        else:
+            base = path.parent
+            files = [path]
 
-        def save_mermaid(match):
-            mermaid_blocks.append(match.group(0))
-            return f"<<<MERMAID_BLOCK_{len(mermaid_blocks) - 1}>>>"
+        for file in sorted(files):
+            if file.is_file():
+                found.setdefault(file.resolve(), base.resolve())
 
-        content_with_placeholders = re.sub(
-            mermaid_pattern, save_mermaid, content, flags=re.DOTALL
-        )
+    return list(found.items())
 
-        # Обрабатываем блоки кода с языком
-        code_pattern = r"```(\w+)\n(.*?)\n```"
 
-        def highlight_match(match):
-            language = match.group(1)
-            code = match.group(2)
-            return self.highlight_code_block(code, language)
+def convert_batch(
+    patterns: List[str],
+    output_dir: Optional[str] = None,
+    output_format: OutputFormat = OutputFormat.HTML,
+    code_style: str = "monokai",
+    theme: Theme = Theme.DEFAULT,
+    config: Optional[Dict[str, Any]] = None,
+    use_online: bool = False,
+    workers: Optional[int] = None,
+) -> List[BatchItemResult]:
+    """
+    Пакетная конвертация файлов в пуле процессов
 
-        content_highlighted = re.sub(
-            code_pattern, highlight_match, content_with_placeholders, flags=re.DOTALL
-        )
+    Каждый воркер держит собственный запущенный браузер на протяжении всей
+    обработки, поэтому Chromium запускается один раз на процесс, а не на файл.
+    При выводе в PDF воркеры готовят только HTML, а печатает родительский
+    процесс через PdfBatchEngine: один браузер, pdf_concurrency документов
+    одновременно в изолированных контекстах.
 
-        # Обрабатываем блоки кода без языка
-        generic_code_pattern = r"```\n(.*?)\n```"
+    Args:
+        patterns: Файлы, каталоги или glob-шаблоны
+        output_dir: Корневой каталог результатов (структура каталогов
+            сохраняется); если не указан, результат пишется рядом с исходником
+        workers: Число процессов (по умолчанию - число ядер)
 
-        def highlight_generic(match):
-            code = match.group(1)
-            return self.highlight_code_block(code)
+    Returns:
+        Результаты по каждому файлу
+    """
+    if output_format == OutputFormat.PDF and (config or {}).get("pdf_sections"):
+        raise ValueError("печать PDF по разделам не поддерживается в пакетном режиме")
 
-        content_highlighted = re.sub(
-            generic_code_pattern,
-            highlight_generic,
-            content_highlighted,
-            flags=re.DOTALL,
-        )
+    jobs = plan_batch(patterns, output_dir, output_format)
+    if not jobs:
+        print("⚠️ Не найдено Markdown файлов для конвертации")
+        return []
 
-        # Восстанавливаем mermaid блоки
-        for i, block in enumerate(mermaid_blocks):
-            content_highlighted = content_highlighted.replace(
-                f"<<<MERMAID_BLOCK_{i}>>>", block
+    config = dict(config or {})
+    if output_dir:
+        # Один манифест и один файл стилей на весь выходной каталог
+        config.setdefault("manifest_file", str(Path(output_dir) / MANIFEST_NAME))
+        if config.get("external_css"):
+            config.setdefault("css_dir", str(output_dir))
+    manifests: Dict[Path, BuildManifest] = {}
+    fingerprints: Dict[Path, str] = {}
+    if config.pop("incremental", False):
+        # Актуальность проверяется здесь, а воркеры конвертируют без проверок
+        full_config = UniversalMarkdownConverter.apply_config_defaults(dict(config))
+        stale_jobs = []
+        for input_file, output_file in jobs:
+            manifest_path = Path(
+                config.get("manifest_file") or output_file.parent / MANIFEST_NAME
+            )
+            if manifest_path not in manifests:
+                manifests[manifest_path] = BuildManifest(manifest_path)
+            fingerprint = input_fingerprint(
+                input_file, output_format, code_style, theme, full_config, use_online
             )
+            if manifests[manifest_path].is_fresh(output_file, fingerprint):
+                continue
+            fingerprints[output_file] = fingerprint
+            stale_jobs.append((input_file, output_file))
 
-        return content_highlighted
+        print(f"⏭️ Без изменений: {len(jobs) - len(stale_jobs)} файлов")
+        jobs = stale_jobs
+        if not jobs:
+            return []
 
-    def render_mermaid_online(self, diagram_code: str) -> Optional[str]:
-        """Рендерит Mermaid диаграмму через онлайн сервис"""
-        url = "https://kroki.io/mermaid/svg"
-        encoded = base64.urlsafe_b64encode(diagram_code.encode("utf-8")).decode("ascii")
+    pdf_mode = output_format == OutputFormat.PDF
+    html_dir = Path(tempfile.mkdtemp(prefix="md_converter_pdf_")) if pdf_mode else None
+    options = {
+        "output_format": output_format,
+        "code_style": code_style,
+        "theme": theme,
+        "config": config or {},
+        "use_online": use_online,
+        "pdf_html_dir": str(html_dir) if html_dir else None,
+    }
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    print(f"📚 Пакетная конвертация: {len(jobs)} файлов, процессов: {workers}")
 
-        try:
-            response = requests.get(f"{url}/{encoded}")
-            if response.status_code == 200:
-                svg_file = self.temp_dir / f"mermaid_{self.mermaid_counter}.svg"
-                svg_file.write_text(response.text, encoding="utf-8")
-                self.mermaid_counter += 1
-                return str(svg_file)
-        except Exception as e:
-            print(f"Ошибка при рендеринге диаграммы: {e}")
-            return None
+    from concurrent.futures import ProcessPoolExecutor, as_completed
 
-    def _render_md_html(self, p, html_file, png_file):
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(f"file:///{html_file.absolute()}")
-        page.wait_for_timeout(2000)
+    start = time.perf_counter()
+    results = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_batch_worker, initargs=(options,)
+        ) as executor:
+            futures = [executor.submit(_convert_batch_item, *job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if not pdf_mode or result.error:
+                    status = "❌" if result.error else "✅"
+                    print(f"{status} {result.seconds:7.2f} с  {result.input_file}")
 
-        element = page.locator(".mermaid")
-        element.screenshot(path=str(png_file))
-        browser.close()
+        if pdf_mode:
+            results = _print_batch_pdfs(results, config)
+    finally:
+        if html_dir is not None:
+            import shutil
 
-    def render_mermaid_local(self, diagram_code: str) -> Optional[str]:
-        """Рендерит Mermaid диаграмму локально через Playwright"""
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
-            <script>mermaid.initialize({ startOnLoad: true });</script>
-            <style>
-                body { background: white; }
-                .mermaid { text-align: center; }
-            </style>
-        </head>
-        <body>
-            <div class="mermaid">
-            {diagram}
-            </div>
-        </body>
-        </html>
-        """
-
-        html_file = self.temp_dir / f"mermaid_{self.mermaid_counter}.html"
-        html_content = html_template.replace("{diagram}", diagram_code)
-        html_file.write_text(html_content, encoding="utf-8")
-
-        png_file = self.temp_dir / f"mermaid_{self.mermaid_counter}.png"
+            shutil.rmtree(html_dir, ignore_errors=True)
 
-        try:
-            with sync_playwright() as p:
-                self._render_md_html(p, html_file, png_file)
-            self.mermaid_counter += 1
-            return str(png_file)
-        except Exception as e:
-            print(f"Ошибка при локальном рендеринге: {e}")
-            return None
+    print_batch_summary(results, time.perf_counter() - start)
 
-    def format_mermaid_for_html(self, diagram_path: str) -> str:
-        """Форматирует Mermaid диаграмму для HTML"""
-        if self.config.get("embed_images"):
-            # Встраиваем SVG напрямую
-            if diagram_path.endswith(".svg"):
-                svg_content = Path(diagram_path).read_text(encoding="utf-8")
-                return f'<div class="mermaid-diagram">{svg_content}</div>'
-            else:
-                # Для PNG используем base64
-                with open(diagram_path, "rb") as img_file:
-                    img_data = img_file.read()
-                    img_base64 = base64.b64encode(img_data).decode("utf-8")
-                    return f'<div class="mermaid-diagram"><img src="data:image/png;base64,{img_base64}" alt="Mermaid Diagram"/></div>'
+    if fingerprints:
+        for result in results:
+            if result.error:
+                continue
+            manifest_path = Path(
+                config.get("manifest_file") or result.output_file.parent / MANIFEST_NAME
+            )
+            manifests[manifest_path].record(
+                result.output_file, fingerprints[result.output_file]
+            )
+        for manifest in manifests.values():
+            manifest.save()
+
+    return results
+
+
+def plan_batch(
+    patterns: List[str],
+    output_dir: Optional[str] = None,
+    output_format: OutputFormat = OutputFormat.HTML,
+) -> List[Tuple[Path, Path]]:
+    """Сопоставляет входным файлам пути результатов (пары вход, выход)"""
+    extension = {OutputFormat.HTML: ".html", OutputFormat.PDF: ".pdf"}[output_format]
+    jobs = []
+    for input_file, base in collect_inputs(patterns):
+        if output_dir:
+            output_file = Path(output_dir) / input_file.relative_to(base)
+            output_file = output_file.with_suffix(extension)
+            output_file.parent.mkdir(parents=True, exist_ok=True)
         else:
-            file_path = Path(diagram_path).absolute()
-            return f'<div class="mermaid-diagram"><img src="file:///{file_path}" alt="Mermaid Diagram"/></div>'
+            output_file = input_file.with_suffix(extension)
+        jobs.append((input_file, output_file))
+    return jobs
 
-    def process_markdown(self, content: str, use_online: bool = False) -> str:
-        """Обрабатывает Markdown, заменяя Mermaid диаграммы и подсвечивая код"""
-        # Подсвечиваем код
-        content = self.process_code_blocks(content)
 
-        # Обрабатываем mermaid диаграммы
-        pattern = r"```mermaid\n(.*?)\n```"
+def watch(
+    patterns: List[str],
+    output_dir: Optional[str] = None,
+    output_file: Optional[str] = None,
+    output_format: OutputFormat = OutputFormat.HTML,
+    code_style: str = "monokai",
+    theme: Theme = Theme.DEFAULT,
+    config: Optional[Dict[str, Any]] = None,
+    use_online: bool = False,
+    interval: float = 1.0,
+) -> None:
+    """
+    Следит за входными файлами и переконвертирует изменившиеся
 
-        def replace_mermaid(match):
-            diagram_code = match.group(1)
+    Изменения определяются по времени модификации, новые файлы подхватываются
+    при каждом опросе. Конвертация инкрементальная, поэтому файл, который
+    только «тронули» без изменения содержимого, не пересобирается. Браузер
+    остаётся запущенным на всё время наблюдения.
+    """
+    config = dict(config or {}, incremental=True)
+    if output_dir:
+        config.setdefault("manifest_file", str(Path(output_dir) / MANIFEST_NAME))
+        if config.get("external_css"):
+            config.setdefault("css_dir", str(output_dir))
+    known: Dict[Path, float] = {}
 
-            if use_online:
-                image_path = self.render_mermaid_online(diagram_code)
-            else:
-                image_path = self.render_mermaid_local(diagram_code)
+    print("👀 Наблюдение за изменениями (Ctrl+C для выхода)...")
+    with BrowserPool() as browser_pool:
+        try:
+            while True:
+                if output_file:
+                    jobs = [(Path(patterns[0]).resolve(), Path(output_file))]
+                else:
+                    jobs = plan_batch(patterns, output_dir, output_format)
+
+                for input_file, job_output in jobs:
+                    try:
+                        mtime = input_file.stat().st_mtime
+                    except OSError:
+                        continue
+                    if known.get(input_file) == mtime:
+                        continue
+                    known[input_file] = mtime
+
+                    converter = UniversalMarkdownConverter(
+                        input_file=str(input_file),
+                        output_format=output_format,
+                        output_file=str(job_output),
+                        code_style=code_style,
+                        theme=theme,
+                        config=dict(config),
+                        browser_pool=browser_pool,
+                    )
+                    try:
+                        converter.convert(use_online_mermaid=use_online)
+                    except Exception as e:
+                        print(f"❌ Ошибка при конвертации {input_file}: {e}")
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("👋 Наблюдение остановлено")
+
+
+def print_batch_summary(results: List[BatchItemResult], wall_time: float) -> None:
+    """Выводит сводку пакетной конвертации"""
+    failed = [result for result in results if result.error]
+    total_time = sum(result.seconds for result in results)
+
+    print("\n" + "=" * 50)
+    print(f"Файлов: {len(results)}, успешно: {len(results) - len(failed)}, ошибок: {len(failed)}")
+    print(f"Общее время: {wall_time:.2f} с (суммарно по файлам: {total_time:.2f} с)")
+    if results:
+        print(f"Среднее время на файл: {total_time / len(results):.2f} с")
+        print("Самые медленные файлы:")
+        for result in sorted(results, key=lambda r: r.seconds, reverse=True)[:5]:
+            print(f"  {result.seconds:7.2f} с  {result.input_file}")
+    if failed:
+        print("Ошибки:")
+        for result in failed:
+            print(f"  ❌ {result.input_file}: {result.error}")
+    print("=" * 50)
 
-            if image_path:
-                return self.format_mermaid_for_html(image_path)
+
+class ServiceStats:
+    """Счётчики сервиса конвертации: задержки, пропускная способность, очередь"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.accepted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.in_flight = 0
+        self._latencies: List[float] = []
+        self._window = window
+        self._recent: List[float] = []
+
+    def record(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def begin(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, seconds: float, ok: bool) -> None:
+        """Учитывает завершённый запрос (время от приёма до ответа)"""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self.completed += 1
             else:
-                return f"<pre><code>{diagram_code}</code></pre>"
+                self.failed += 1
+            self._latencies.append(seconds)
+            if len(self._latencies) > self._window:
+                del self._latencies[: len(self._latencies) - self._window]
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.pop(0)
 
-        processed_content = re.sub(pattern, replace_mermaid, content, flags=re.DOTALL)
-        return processed_content
+    def snapshot(self, queue_depth: int) -> Dict[str, Any]:
+        """Текущее состояние счётчиков (для /stats)"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            uptime = time.monotonic() - self.started
+            recent = [t for t in self._recent if time.monotonic() - t <= 60]
 
-    def markdown_to_html(self, content: str) -> str:
-        """Конвертирует обработанный Markdown в HTML"""
-        return markdown.markdown(content, extensions=self.markdown_extensions)
+            def percentile(p: float) -> Optional[float]:
+                if not latencies:
+                    return None
+                index = min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))
+                return round(latencies[index] * 1000, 1)
 
-    def create_html_document(self, body_content: str) -> str:
-        """Создает полный HTML документ"""
-        title = self.input_file.stem.replace("_", " ").title()
-        theme_css = self.THEMES[self.theme]
+            return {
+                "uptime_s": round(uptime, 1),
+                "accepted": self.accepted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "in_flight": self.in_flight,
+                "queue_depth": queue_depth,
+                "latency_ms": {
+                    "p50": percentile(0.5),
+                    "p95": percentile(0.95),
+                    "p99": percentile(0.99),
+                    "max": percentile(1.0),
+                    "mean": round(sum(latencies) / len(latencies) * 1000, 1)
+                    if latencies
+                    else None,
+                },
+                "throughput_per_s": {
+                    "overall": round(self.completed / uptime, 3) if uptime else 0.0,
+                    "last_60s": round(len(recent) / min(60.0, uptime or 1.0), 3),
+                },
+            }
 
-        # Получаем дополнительный CSS, если тема не минимальная
-        if self.theme != Theme.MINIMAL:
-            theme_css = self.THEMES[Theme.DEFAULT] + "\n" + self.THEMES[self.theme]
 
-        pygments_css = self.code_formatter.get_style_defs(".highlight")
+class ConversionService:
+    """
+    Сервис конвертации с прогретым браузером и кэшами
 
-        if self.config.get("standalone"):
-            return f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title}</title>
-    <style>
-        {theme_css}
-        
-        /* Pygments syntax highlighting */
-        {pygments_css}
-    </style>
-</head>
-<body>
-    {body_content}
-</body>
-</html>"""
-        else:
-            return body_content
+    Запросы попадают в ограниченную очередь и выполняются по одному рабочим
+    потоком. Браузер (BrowserPool со своим потоком Playwright) запускается
+    один раз и живёт всё время работы сервиса. Конвертеры
+    переиспользуются для одинаковых настроек (вместе с клиентом Kroki и
+    кэшами), движки Markdown и лексеры общие для процесса. Переполненная
+    очередь сразу отклоняет запрос (submit() возвращает None).
+    """
 
-    def minify_html(self, html_content: str) -> str:
-        """Минифицирует HTML"""
-        import re
+    # Настройки, которые клиент может передать в запросе
+    REQUEST_OPTIONS = {
+        "minify",
+        "include_toc",
+        "standalone",
+        "embed_images",
+        "title",
+        "default_language",
+        "guess_language",
+        "mermaid_output",
+    }
+    # Короткие имена настроек, как у флагов командной строки
+    REQUEST_ALIASES = {"toc": "include_toc"}
+
+    def __init__(
+        self,
+        code_style: str = "monokai",
+        theme: Theme = Theme.DEFAULT,
+        config: Optional[Dict[str, Any]] = None,
+        use_online: bool = False,
+        queue_size: int = 16,
+        max_converters: int = 8,
+    ):
+        import queue
 
-        # Убираем комментарии
-        html_content = re.sub(r"<!--.*?-->", "", html_content, flags=re.DOTALL)
-        # Убираем лишние пробелы между тегами
-        html_content = re.sub(r">\s+<", "><", html_content)
-        # Убираем лишние пробелы в начале строк
-        html_content = re.sub(r"^\s+", "", html_content, flags=re.MULTILINE)
+        self.code_style = code_style
+        self.theme = theme
+        self.config = dict(config or {}, verbose=False, raise_errors=True)
+        self.use_online = use_online
+        self.stats = ServiceStats()
+        self.max_converters = max_converters
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._converters: "OrderedDict[Any, UniversalMarkdownConverter]" = OrderedDict()
+        self._browser_pool: Optional[BrowserPool] = None
+        self._worker = threading.Thread(
+            target=self._run, name="md-converter-worker", daemon=True
+        )
+        self._worker.start()
 
-        return html_content.strip()
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
 
-    def generate_html(self, use_online_mermaid: bool = False) -> str:
+    def submit(self, content: str, options: Dict[str, Any]):
         """
-        Генерирует HTML из Markdown
-        Это центральный метод, используемый как для HTML, так и для PDF
+        Ставит конвертацию в очередь
+
+        Args:
+            content: Исходный Markdown
+            options: format ("html"/"pdf"), theme, style, online и
+                настройки из REQUEST_OPTIONS
 
         Returns:
-            Готовый HTML документ
+            concurrent.futures.Future с HTML (str) или PDF (bytes), либо
+            None, если очередь заполнена
         """
-        print(f"📄 Обработка {self.input_file}...")
-        print(f"🎨 Стиль подсветки кода: {self.code_style}")
-        print(f"🎨 Тема оформления: {self.theme.value}")
+        import queue
+        from concurrent.futures import Future
 
-        # Читаем Markdown файл
-        content = self.input_file.read_text(encoding="utf-8")
+        future: "Future" = Future()
+        try:
+            self._queue.put_nowait((content, options, future))
+        except queue.Full:
+            self.stats.record("rejected")
+            return None
+        self.stats.record("accepted")
+        return future
 
-        # Обрабатываем код и Mermaid диаграммы
-        print("🖌️ Подсветка синтаксиса кода...")
-        print("🎨 Рендеринг Mermaid диаграмм...")
-        processed_content = self.process_markdown(
-            content, use_online=use_online_mermaid
-        )
+    def _converter(self, options: Dict[str, Any]) -> UniversalMarkdownConverter:
+        """Конвертер для набора настроек (кэш на max_converters вариантов)"""
+        theme = Theme(options.get("theme") or self.theme.value)
+        code_style = options.get("style") or self.code_style
+        overrides = {}
+        for key, value in options.items():
+            key = self.REQUEST_ALIASES.get(key, key)
+            if key in self.REQUEST_OPTIONS:
+                overrides[key] = value
+        key = (theme, code_style, json.dumps(overrides, sort_keys=True))
+        converter = self._converters.get(key)
+        if converter is None:
+            converter = UniversalMarkdownConverter(
+                code_style=code_style,
+                theme=theme,
+                config=dict(self.config, **overrides),
+                browser_pool=self._browser_pool,
+            )
+            self._converters[key] = converter
+            if len(self._converters) > self.max_converters:
+                _, evicted = self._converters.popitem(last=False)
+                evicted.cleanup()
+        else:
+            self._converters.move_to_end(key)
+        return converter
 
-        # Конвертируем в HTML
-        print("📝 Генерация HTML...")
-        html_body = self.markdown_to_html(processed_content)
+    def _convert(self, content: str, options: Dict[str, Any]) -> Union[str, bytes]:
+        converter = self._converter(options)
+        use_online = bool(options.get("online", self.use_online))
+        html_content = converter.render_string(content, use_online)
+        if (options.get("format") or "html").lower() == "pdf":
+            return converter.render_pdf(html_content)
+        return html_content
 
-        # Создаем финальный HTML документ
-        html_content = self.create_html_document(html_body)
+    def _run(self) -> None:
+        """Рабочий поток: создаёт общий браузер и выполняет задания по очереди"""
+        self._browser_pool = BrowserPool()
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                content, options, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self._convert(content, options))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            for converter in self._converters.values():
+                converter.cleanup()
+            self._converters.clear()
+            self._browser_pool.close()
 
-        # Минифицируем если нужно
-        if self.config.get("minify"):
-            print("📦 Минификация HTML...")
-            html_content = self.minify_html(html_content)
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Дожидается текущих заданий и останавливает рабочий поток"""
+        self._queue.put(None)
+        self._worker.join(timeout)
 
-        return html_content
 
-    def convert_to_html(self, use_online_mermaid: bool = False) -> None:
-        """Конвертирует Markdown в HTML файл"""
-        html_content = self.generate_html(use_online_mermaid)
+def _make_service_handler(
+    service: ConversionService, request_timeout: float, max_body: int
+):
+    """Класс обработчика HTTP запросов для сервиса конвертации"""
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qsl, urlsplit
 
-        # Сохраняем результат
-        self.output_file.write_text(html_content, encoding="utf-8")
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "md-converter"
 
-        print(f"✅ HTML успешно создан: {self.output_file}")
-        self._show_file_size()
+        def log_message(self, format: str, *args: Any) -> None:
+            # Счётчики доступны через /stats, построчный лог не нужен
+            pass
 
-    def _pdf_rendering(self, p, html_file):
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(f"file:///{html_file.absolute()}")
-        page.wait_for_timeout(2000)
+        def _reply(
+            self, status: int, body: Union[str, bytes], content_type: str, **headers: str
+        ) -> None:
+            data = body.encode("utf-8") if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name.replace("_", "-"), value)
+            self.end_headers()
+            self.wfile.write(data)
 
-        # Генерируем PDF
-        page.pdf(
-            path=str(self.output_file),
-            format="A4",
-            margin={
-                "top": "20mm",
-                "right": "20mm",
-                "bottom": "20mm",
-                "left": "20mm",
-            },
-            print_background=True,
-        )
+        def _reply_json(self, status: int, data: Dict[str, Any], **headers: str) -> None:
+            self._reply(
+                status,
+                json.dumps(data, ensure_ascii=False),
+                "application/json; charset=utf-8",
+                **headers,
+            )
 
-        browser.close()
+        def do_GET(self) -> None:
+            path = urlsplit(self.path).path
+            if path == "/stats":
+                data = service.stats.snapshot(service.queue_depth)
+                self._reply_json(200, data)
+            elif path == "/health":
+                self._reply_json(200, {"status": "ok"})
+            else:
+                self._reply_json(404, {"error": "not found"})
 
-    def convert_to_pdf(self, use_online_mermaid: bool = False) -> None:
-        """Конвертирует Markdown в PDF через HTML"""
-        # Сначала генерируем HTML
-        html_content = self.generate_html(use_online_mermaid)
+        def do_POST(self) -> None:
+            url = urlsplit(self.path)
+            if url.path != "/convert":
+                self._reply_json(404, {"error": "not found"})
+                return
+            header = self.headers.get("Content-Length")
+            if header is None:
+                self._reply_json(411, {"error": "не указан Content-Length"})
+                return
+            try:
+                length = int(header)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._reply_json(400, {"error": f"некорректный Content-Length: {header}"})
+                return
+            if length > max_body:
+                self._reply_json(413, {"error": f"тело запроса больше {max_body} байт"})
+                return
+            body = self.rfile.read(length)
 
-        # Сохраняем HTML во временный файл
-        html_file = self.temp_dir / "temp.html"
-        html_file.write_text(html_content, encoding="utf-8")
+            # Markdown в теле и настройки в параметрах URL, либо JSON
+            # {"markdown": ..., "format": ..., "options": {...}}
+            options: Dict[str, Any] = dict(parse_qsl(url.query))
+            try:
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    payload = json.loads(body)
+                    content = payload["markdown"]
+                    if not isinstance(content, str):
+                        raise TypeError("поле markdown должно быть строкой")
+                    options.update(payload.get("options") or {})
+                    for key in ("format", "theme", "style", "online"):
+                        if key in payload:
+                            options[key] = payload[key]
+                else:
+                    content = body.decode("utf-8")
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply_json(400, {"error": f"некорректный запрос: {e}"})
+                return
+            for key, value in list(options.items()):
+                if value in ("1", "true", "yes"):
+                    options[key] = True
+                elif value in ("0", "false", "no"):
+                    options[key] = False
 
-        print("📑 Генерация PDF...")
+            start = time.perf_counter()
+            future = service.submit(content, options)
+            if future is None:
+                self._reply_json(503, {"error": "очередь заполнена"}, Retry_After="1")
+                return
+            service.stats.begin()
+            from concurrent.futures import TimeoutError as FutureTimeout
 
-        try:
-            with sync_playwright() as p:
-                self._pdf_rendering(p, html_file)
-            print(f"✅ PDF успешно создан: {self.output_file}")
-            self._show_file_size()
+            error = None
+            try:
+                result = future.result(timeout=request_timeout)
+            except Exception as e:
+                error = e
+                if isinstance(e, FutureTimeout):
+                    future.cancel()
+                    service.stats.record("timed_out")
+            # Счётчики обновляются до ответа, чтобы /stats сразу их видел
+            service.stats.finish(time.perf_counter() - start, error is None)
 
-        except Exception as e:
-            print(f"❌ Ошибка при создании PDF: {e}")
-            print("Попробуйте установить Chromium: playwright install chromium")
+            if isinstance(error, FutureTimeout):
+                self._reply_json(504, {"error": "превышено время ожидания"})
+            elif isinstance(error, (ValueError, KeyError)):
+                self._reply_json(400, {"error": f"{type(error).__name__}: {error}"})
+            elif error is not None:
+                self._reply_json(500, {"error": f"{type(error).__name__}: {error}"})
+            elif isinstance(result, bytes):
+                self._reply(200, result, "application/pdf")
+            else:
+                self._reply(200, result, "text/html; charset=utf-8")
 
-    def convert(self, use_online_mermaid: bool = False) -> None:
-        """
-        Универсальный метод конвертации
-        Выбирает нужный конвертер на основе output_format
-        """
-        if self.output_format == OutputFormat.HTML:
-            self.convert_to_html(use_online_mermaid)
-        elif self.output_format == OutputFormat.PDF:
-            self.convert_to_pdf(use_online_mermaid)
-        else:
-            raise ValueError(f"Неподдерживаемый формат: {self.output_format}")
+    return Handler
 
-        # Очищаем временные файлы
-        self.cleanup()
 
-    def cleanup(self) -> None:
-        """Очищает временные файлы"""
-        import shutil
+def serve(
+    address: str = "127.0.0.1:8765",
+    code_style: str = "monokai",
+    theme: Theme = Theme.DEFAULT,
+    config: Optional[Dict[str, Any]] = None,
+    use_online: bool = False,
+    queue_size: int = 16,
+    request_timeout: float = 120.0,
+    max_body: int = 16 * 1024 * 1024,
+) -> None:
+    """
+    Запускает сервис конвертации (до Ctrl+C)
 
-        if self.temp_dir.exists():
-            shutil.rmtree(self.temp_dir)
+    Эндпоинты:
+        POST /convert - Markdown в теле (параметры format, theme, style,
+            online, minify, ... в URL) или JSON {"markdown", "format",
+            "options"}; ответ - HTML или PDF. 503 при заполненной очереди,
+            504 при превышении request_timeout.
+        GET /stats - счётчики задержек, пропускной способности и очереди
+        GET /health - проверка доступности
 
-    def _show_file_size(self) -> None:
-        """Показывает размер созданного файла"""
-        file_size = self.output_file.stat().st_size
-        if file_size > 1024 * 1024:
-            size_str = f"{file_size / (1024 * 1024):.2f} MB"
-        else:
-            size_str = f"{file_size / 1024:.2f} KB"
-        print(f"📊 Размер файла: {size_str}")
+    Args:
+        address: "host:port" или "unix:/path/to/socket"
+        queue_size: Размер очереди заданий (сверх неё запросы отклоняются)
+        request_timeout: Максимальное ожидание результата запросом, с
+        max_body: Максимальный размер тела запроса, байт
+    """
+    import socketserver
+    from http.server import ThreadingHTTPServer
+
+    service = ConversionService(
+        code_style=code_style,
+        theme=theme,
+        config=config,
+        use_online=use_online,
+        queue_size=queue_size,
+    )
+    handler = _make_service_handler(service, request_timeout, max_body)
+
+    if address.startswith("unix:"):
+        socket_path = Path(address[len("unix:") :])
+        if socket_path.exists():
+            socket_path.unlink()
+
+        class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        server = UnixHTTPServer(str(socket_path), handler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+        server.daemon_threads = True
+
+    print(f"🚀 Сервис конвертации слушает {address} (Ctrl+C для выхода)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("👋 Сервис остановлен")
+    finally:
+        server.server_close()
+        service.close(timeout=10)
+        if address.startswith("unix:") and socket_path.exists():
+            socket_path.unlink()
 
 
 def setup_playwright():
@@ -787,6 +4347,9 @@ def setup_playwright():
 
 def list_available_styles():
     """Показывает доступные стили подсветки синтаксиса"""
+    _require("pygments", "pygments", "подсветки синтаксиса")
+    from pygments.styles import get_all_styles
+
     styles = list(get_all_styles())
     print("\n🎨 Доступные стили подсветки синтаксиса:")
     print("=" * 50)
@@ -815,9 +4378,11 @@ def main():
 
 Использование:
     python universal_converter.py input.md [опции]
+    python universal_converter.py docs/ "more/**/*.md" --output-dir out [опции]
 
 Параметры:
-    input.md       - входной Markdown файл
+    input.md       - входной Markdown файл, каталог или glob-шаблон
+                     (несколько входов, каталог или шаблон - пакетный режим)
 
 Опции:
     --format FORMAT    - формат вывода: html (по умолчанию) или pdf
@@ -829,7 +4394,41 @@ def main():
     --no-standalone   - генерировать только body HTML
     --no-embed        - не встраивать изображения в HTML
     --toc             - добавить оглавление
+    --mermaid-js PATH - локальная копия mermaid.min.js (или URL) вместо CDN
+    --mermaid-png     - локальные диаграммы снимком в PNG вместо SVG
+    --webp            - локальные диаграммы снимком в WebP (нужен пакет Pillow)
+    --no-cache        - не использовать кэш отрендеренных диаграмм
+    --cache-dir DIR   - каталог кэша (по умолчанию ~/.cache/md_converter)
+    --debug-dir DIR   - сохранять промежуточные файлы (HTML, диаграммы) в DIR
+    --profile         - вывести время и CPU по этапам конвертации
+    --profile-memory  - добавить пик памяти по этапам (tracemalloc, медленнее)
+    --profile-json FILE - записать профиль конвертации в JSON
+    --kroki-url URL   - адрес сервиса Kroki (по умолчанию https://kroki.io)
+    --online-workers N - число параллельных запросов к онлайн сервису
+    --default-lang LANG - язык для блоков кода без указанного языка
+    --no-guess        - не угадывать язык блоков кода по содержимому
+    --parallel-highlight - подсвечивать код больших документов в нескольких процессах
+    --highlight-workers N - число процессов параллельной подсветки
+    --external-css    - вынести стили в общий файл md-<хэш>.css вместо встраивания
+    --css-dir DIR     - каталог общего файла стилей (по умолчанию - каталог результата)
+    --gzip            - записать рядом с HTML сжатую копию .gz
+    --brotli          - записать рядом с HTML сжатую копию .br (нужен пакет brotli)
+    --stream          - потоковая обработка по разделам (для очень больших файлов)
+    --persist-highlight - сохранять подсвеченный код в кэше на диске
+    --wait MODE       - ожидание страниц: ready (по сигналу готовности) или fixed
+    --render-timeout MS - максимальное ожидание готовности страницы, мс
+    --incremental     - пропускать файлы, входные данные которых не изменились
+    --watch           - следить за изменениями и переконвертировать изменённые файлы
+    --output-dir DIR  - корневой каталог результатов пакетной конвертации
+    --workers N       - число процессов пакетной конвертации (по умолчанию - число ядер)
+    --pdf-concurrency N - сколько PDF (или разделов PDF) печатать одновременно (4)
+    --pdf-sections    - печатать большой PDF по разделам параллельно (нужен pypdf)
+    --page-numbers    - сквозные номера страниц в PDF
+    --split-pages [N] - HTML страницами по заголовкам до уровня N (1) с оглавлением
+    --serve [ADDR]    - сервис конвертации: host:port (127.0.0.1:8765) или unix:/путь
+    --queue-size N    - размер очереди заданий сервиса (по умолчанию 16)
     --list-styles     - показать все доступные стили подсветки
+    --install-browsers - установить Chromium для Playwright (нужен для PDF)
 
 Примеры:
     python universal_converter.py document.md
@@ -837,11 +4436,13 @@ def main():
     python universal_converter.py document.md --format html --theme dark
     python universal_converter.py document.md --output report.pdf --format pdf
     python universal_converter.py document.md --style github --theme github
+    python universal_converter.py docs/ --output-dir site --workers 8
     python universal_converter.py --list-styles
 
 Первый запуск:
-    При первом запуске для PDF будет установлен Chromium (~130MB)
-    Или используйте флаг --online для работы без Chromium
+    Для PDF и локального рендеринга Mermaid нужен Chromium (~130MB):
+        python universal_converter.py --install-browsers
+    Или используйте флаг --online для диаграмм без Chromium
         """
         )
         sys.exit(1)
@@ -851,16 +4452,25 @@ def main():
         list_available_styles()
         sys.exit(0)
 
+    if sys.argv[1] == "--install-browsers":
+        setup_playwright()
+        sys.exit(0)
+
     # Парсинг аргументов
-    input_file = sys.argv[1]
+    inputs = []
     output_file = None
+    output_dir = None
+    workers = None
+    watch_mode = False
+    serve_address = None
+    queue_size = 16
     output_format = OutputFormat.HTML
     theme = Theme.DEFAULT
     code_style = "monokai"
     use_online = False
     config = {}
 
-    i = 2
+    i = 1
     while i < len(sys.argv):
         arg = sys.argv[i]
 
@@ -908,18 +4518,148 @@ def main():
         elif arg == "--toc":
             config["include_toc"] = True
 
+        elif arg == "--webp":
+            config["mermaid_output"] = "png"
+            config["image_format"] = "webp"
+
+        elif arg == "--mermaid-png":
+            config["mermaid_output"] = "png"
+
+        elif arg == "--mermaid-js" and i + 1 < len(sys.argv):
+            config["mermaid_js"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--kroki-url" and i + 1 < len(sys.argv):
+            config["kroki_url"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--online-workers" and i + 1 < len(sys.argv):
+            config["online_workers"] = int(sys.argv[i + 1])
+            i += 1
+
+        elif arg == "--default-lang" and i + 1 < len(sys.argv):
+            config["default_language"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--no-guess":
+            config["guess_language"] = False
+
+        elif arg == "--parallel-highlight":
+            config["parallel_highlight"] = True
+
+        elif arg == "--highlight-workers" and i + 1 < len(sys.argv):
+            config["parallel_highlight"] = True
+            config["highlight_workers"] = int(sys.argv[i + 1])
+            i += 1
+
+        elif arg == "--external-css":
+            config["external_css"] = True
+
+        elif arg == "--css-dir" and i + 1 < len(sys.argv):
+            config["css_dir"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--gzip":
+            config.setdefault("precompress", []).append("gzip")
+
+        elif arg == "--brotli":
+            config.setdefault("precompress", []).append("br")
+
+        elif arg == "--stream":
+            config["streaming"] = True
+
+        elif arg == "--persist-highlight":
+            config["highlight_cache_persistent"] = True
+
+        elif arg == "--profile":
+            config["profile"] = True
+
+        elif arg == "--profile-memory":
+            config["profile"] = True
+            config["profile_memory"] = True
+
+        elif arg == "--profile-json" and i + 1 < len(sys.argv):
+            config["profile"] = True
+            config["profile_json"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--debug-dir" and i + 1 < len(sys.argv):
+            config["debug_dir"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--no-cache":
+            config["mermaid_cache"] = False
+
+        elif arg == "--cache-dir" and i + 1 < len(sys.argv):
+            config["cache_dir"] = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--wait" and i + 1 < len(sys.argv):
+            wait_mode = sys.argv[i + 1].lower()
+            if wait_mode in ("ready", "fixed"):
+                config["wait_mode"] = wait_mode
+            else:
+                print(f"⚠️ Неизвестный режим ожидания '{wait_mode}', используется ready")
+            i += 1
+
+        elif arg == "--render-timeout" and i + 1 < len(sys.argv):
+            config["render_timeout"] = int(sys.argv[i + 1])
+            i += 1
+
+        elif arg == "--incremental":
+            config["incremental"] = True
+
+        elif arg == "--watch":
+            watch_mode = True
+
+        elif arg == "--output-dir" and i + 1 < len(sys.argv):
+            output_dir = sys.argv[i + 1]
+            i += 1
+
+        elif arg == "--workers" and i + 1 < len(sys.argv):
+            workers = int(sys.argv[i + 1])
+            i += 1
+
+        elif arg == "--pdf-sections":
+            config["pdf_sections"] = True
+
+        elif arg == "--split-pages":
+            config["split_pages"] = 1
+            if i + 1 < len(sys.argv) and sys.argv[i + 1].isdigit():
+                config["split_pages"] = int(sys.argv[i + 1])
+                i += 1
+
+        elif arg == "--page-numbers":
+            config["pdf_page_numbers"] = True
+
+        elif arg == "--pdf-concurrency" and i + 1 < len(sys.argv):
+            config["pdf_concurrency"] = int(sys.argv[i + 1])
+            i += 1
+
+        elif arg == "--serve":
+            serve_address = "127.0.0.1:8765"
+            if i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith("--"):
+                serve_address = sys.argv[i + 1]
+                i += 1
+
+        elif arg == "--queue-size" and i + 1 < len(sys.argv):
+            queue_size = int(sys.argv[i + 1])
+            i += 1
+
         elif arg == "--list-styles":
             list_available_styles()
             sys.exit(0)
 
-        i += 1
+        elif arg == "--install-browsers":
+            setup_playwright()
 
-    # Проверяем существование входного файла
-    if not Path(input_file).exists():
-        print(f"❌ Файл не найден: {input_file}")
-        sys.exit(1)
+        elif not arg.startswith("--"):
+            inputs.append(arg)
+
+        i += 1
 
     # Проверяем валидность стиля
+    _require("pygments", "pygments", "подсветки синтаксиса")
     try:
         from pygments.styles import get_style_by_name
 
@@ -931,9 +4671,63 @@ def main():
         print("   Используйте --list-styles для просмотра доступных стилей")
         code_style = "monokai"
 
-    # Устанавливаем Playwright если нужно для PDF
-    if output_format == OutputFormat.PDF and not use_online:
-        setup_playwright()
+    if serve_address:
+        serve(
+            serve_address,
+            code_style=code_style,
+            theme=theme,
+            config=config,
+            use_online=use_online,
+            queue_size=queue_size,
+        )
+        sys.exit(0)
+
+    if not inputs:
+        print("❌ Не указан входной файл")
+        sys.exit(1)
+
+    batch_mode = (
+        len(inputs) > 1
+        or output_dir is not None
+        or any(glob.has_magic(item) or Path(item).is_dir() for item in inputs)
+    )
+    input_file = inputs[0]
+
+    # Проверяем существование входного файла
+    if not batch_mode and not Path(input_file).exists():
+        print(f"❌ Файл не найден: {input_file}")
+        sys.exit(1)
+
+    if watch_mode:
+        watch(
+            inputs,
+            output_dir=output_dir,
+            output_file=None if batch_mode else output_file,
+            output_format=output_format,
+            code_style=code_style,
+            theme=theme,
+            config=config,
+            use_online=use_online,
+        )
+        sys.exit(0)
+
+    if batch_mode:
+        if output_file:
+            print("⚠️ --output игнорируется в пакетном режиме, используйте --output-dir")
+        if output_format == OutputFormat.PDF and config.get("pdf_sections"):
+            print("❌ --pdf-sections не поддерживается в пакетном режиме")
+            sys.exit(1)
+        results = convert_batch(
+            inputs,
+            output_dir=output_dir,
+            output_format=output_format,
+            code_style=code_style,
+            theme=theme,
+            config=config,
+            use_online=use_online,
+            workers=workers,
+        )
+        sys.exit(1 if any(result.error for result in results) else 0)
 
     # Создаем конвертер и выполняем конвертацию
     converter = UniversalMarkdownConverter(
@@ -949,4 +4743,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except MissingDependencyError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конвертера Markdown (md_converter.py)
+
+Генерирует синтетические документы нескольких размеров (блоки кода на
+разных языках, блоки без языка, Mermaid диаграммы) и замеряет отдельные
+этапы и полную конвертацию. Онлайн рендеринг диаграмм идёт в локальную
+заглушку Kroki, поэтому результаты не зависят от сети.
+
+Результаты сохраняются в JSON, два прогона можно сравнить:
+    python md_converter_bench.py
+    python md_converter_bench.py --sizes small medium --repeat 10
+    python md_converter_bench.py --compare bench_results/old.json bench_results/new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import md_converter  # noqa: E402
+
+# Размеры документов: (разделов, блоков кода в разделе, диаграмм на документ)
+SIZES = {
+    "small": (5, 2, 2),
+    "medium": (50, 4, 10),
+    "large": (400, 5, 40),
+}
+
+_LANGUAGE_SNIPPETS = {
+    "python": "def handler_{n}(items):\n    total = 0\n    for item in items:\n        total += item * {n}\n    return total\n",
+    "javascript": "function handler{n}(items) {{\n  return items.map((x) => x * {n}).filter(Boolean);\n}}\n",
+    "go": "func Handler{n}(items []int) int {{\n\ttotal := 0\n\tfor _, v := range items {{\n\t\ttotal += v * {n}\n\t}}\n\treturn total\n}}\n",
+    "sql": "SELECT id, name, SUM(amount) AS total_{n}\nFROM orders\nWHERE status = 'paid'\nGROUP BY id, name\nORDER BY total_{n} DESC;\n",
+    "bash": 'for f in *.log; do\n  gzip -9 "$f" && echo "done {n}: $f"\ndone\n',
+    "json": '{{"id": {n}, "tags": ["a", "b"], "enabled": true, "ratio": 0.{n}}}\n',
+    "rust": "fn handler_{n}(items: &[i64]) -> i64 {{\n    items.iter().map(|x| x * {n}).sum()\n}}\n",
+}
+
+
+def generate_document(
+    sections: int,
+    blocks_per_section: int,
+    diagrams: int,
+    untagged_ratio: float = 0.2,
+    duplicate_ratio: float = 0.25,
+    seed: int = 42,
+) -> str:
+    """
+    Генерирует синтетический Markdown документ
+
+    Args:
+        sections: Число разделов (заголовков первого уровня)
+        blocks_per_section: Блоков кода в разделе
+        diagrams: Число Mermaid диаграмм на документ
+        untagged_ratio: Доля блоков кода без указанного языка
+        duplicate_ratio: Доля повторяющихся диаграмм
+        seed: Зерно генератора (одинаковое зерно - одинаковый документ)
+    """
+    rng = random.Random(seed)
+    languages = sorted(_LANGUAGE_SNIPPETS)
+    diagram_sections = set(rng.sample(range(sections), min(diagrams, sections)))
+    extra_diagrams = max(diagrams - sections, 0)
+    diagram_codes: List[str] = []
+
+    def next_diagram() -> str:
+        if diagram_codes and rng.random() < duplicate_ratio:
+            return rng.choice(diagram_codes)
+        n = len(diagram_codes)
+        code = f"graph TD\n    A{n}[Start {n}] --> B{n}{{Check}}\n    B{n} -->|yes| C{n}[Done]\n    B{n} -->|no| A{n}\n"
+        diagram_codes.append(code)
+        return code
+
+    parts = ["# Benchmark document\n\nСинтетический документ для замеров.\n"]
+    for section in range(sections):
+        parts.append(f"\n# Section {section}\n\n")
+        parts.append(
+            "Paragraph with **bold**, *italic*, `inline code` and a [link](https://example.com). "
+            * 3
+            + "\n\n| Key | Value |\n|-----|-------|\n| a | 1 |\n| b | 2 |\n\n"
+        )
+        for block in range(blocks_per_section):
+            language = rng.choice(languages)
+            snippet = _LANGUAGE_SNIPPETS[language].format(n=section * 100 + block)
+            tag = "" if rng.random() < untagged_ratio else language
+            parts.append(f"## Block {block}\n\n```{tag}\n{snippet}```\n\n")
+        if section in diagram_sections:
+            parts.append(f"```mermaid\n{next_diagram()}```\n\n")
+    for _ in range(extra_diagrams):
+        parts.append(f"```mermaid\n{next_diagram()}```\n\n")
+    return "".join(parts)
+
+
+class KrokiStub:
+    """Локальная заглушка сервиса Kroki: отвечает SVG с исходным кодом диаграммы"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                stub.requests += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                lines = "".join(
+                    f'<text x="10" y="{20 * (i + 1)}">{line.strip()}</text>'
+                    for i, line in enumerate(body.splitlines())
+                )
+                svg = (
+                    '<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg" '
+                    f'width="400" height="200">\n  <!-- stub -->\n  {lines}\n</svg>\n'
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "image/svg+xml")
+                self.send_header("Content-Length", str(len(svg)))
+                self.end_headers()
+                self.wfile.write(svg)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self) -> "KrokiStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """Запускает func warmup + repeat раз и возвращает статистику времени (мс)"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.mean(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "repeat": repeat,
+    }
+
+
+def _cold_config(work_dir: Path, kroki_url: str, **extra: Any) -> Dict[str, Any]:
+    """Настройки без кэшей между повторами: замеряется работа, а не кэш"""
+    return dict(
+        {
+            "verbose": False,
+            "raise_errors": True,
+            "mermaid_cache": False,
+            "highlight_cache": False,
+            "kroki_url": kroki_url,
+            "cache_dir": str(work_dir / "cache"),
+        },
+        **extra,
+    )
+
+
+def bench_size(
+    name: str, work_dir: Path, kroki_url: str, repeat: int, pdf: bool
+) -> Dict[str, Any]:
+    """Замеры для документа одного размера"""
+    sections, blocks, diagrams = SIZES[name]
+    content = generate_document(sections, blocks, diagrams)
+    input_file = work_dir / f"{name}.md"
+    input_file.write_text(content, encoding="utf-8")
+
+    results: Dict[str, Any] = {
+        "document": {
+            "chars": len(content),
+            "sections": sections,
+            "code_blocks": sections * blocks,
+            "diagrams": diagrams,
+        }
+    }
+
+    converter = md_converter.UniversalMarkdownConverter(
+        config=_cold_config(work_dir, kroki_url)
+    )
+    try:
+        results["process_code_blocks"] = measure(
+            lambda: converter.process_code_blocks(content), repeat
+        )
+        processed = converter.process_markdown(content, use_online=True)
+        results["markdown_to_html"] = measure(
+            lambda: converter.markdown_to_html(processed), repeat
+        )
+        html_content = converter.create_html_document(
+            converter.markdown_to_html(processed)
+        )
+        results["minify_html"] = measure(
+            lambda: converter.minify_html(html_content), repeat
+        )
+    finally:
+        converter.cleanup()
+
+    def convert(output_format: md_converter.OutputFormat, suffix: str) -> None:
+        md_converter.UniversalMarkdownConverter(
+            input_file=str(input_file),
+            output_format=output_format,
+            output_file=str(work_dir / f"{name}{suffix}"),
+            config=_cold_config(work_dir, kroki_url),
+        ).convert(use_online_mermaid=True)
+
+    results["end_to_end_html"] = measure(
+        lambda: convert(md_converter.OutputFormat.HTML, ".html"), repeat
+    )
+    if pdf:
+        try:
+            results["end_to_end_pdf"] = measure(
+                lambda: convert(md_converter.OutputFormat.PDF, ".pdf"),
+                max(1, repeat // 2),
+            )
+        except Exception as e:
+            reason = str(e).splitlines()[0] if str(e) else ""
+            results["end_to_end_pdf"] = {"skipped": f"{type(e).__name__}: {reason}"}
+    return results
+
+
+def bench_startup(repeat: int) -> Dict[str, float]:
+    """Время запуска интерпретатора с импортом конвертера"""
+    module_dir = str(Path(md_converter.__file__).resolve().parent)
+    code = f"import sys; sys.path.insert(0, {module_dir!r}); import md_converter"
+    command = [sys.executable, "-c", code]
+    return measure(lambda: subprocess.run(command, check=True), repeat)
+
+
+def environment() -> Dict[str, Any]:
+    """Описание окружения прогона (для сравнения результатов)"""
+    commit = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+        "converter_version": md_converter._converter_version()[:12],
+    }
+
+
+def run(sizes: List[str], repeat: int, pdf: bool, kroki_delay: float) -> Dict[str, Any]:
+    """Полный прогон бенчмарка"""
+    report: Dict[str, Any] = {"environment": environment(), "sizes": {}}
+    report["startup"] = bench_startup(repeat)
+    with KrokiStub(delay=kroki_delay) as stub, tempfile.TemporaryDirectory() as tmp:
+        for name in sizes:
+            print(f"⏱️ {name}...", flush=True)
+            report["sizes"][name] = bench_size(name, Path(tmp), stub.url, repeat, pdf)
+        report["kroki_requests"] = stub.requests
+    return report
+
+
+def _flatten(report: Dict[str, Any]) -> Dict[Tuple[str, str], float]:
+    """(размер, замер) -> медиана, для сравнения и вывода"""
+    flat = {}
+    if "median_ms" in report.get("startup", {}):
+        flat[("-", "startup")] = report["startup"]["median_ms"]
+    for size, results in report.get("sizes", {}).items():
+        for key, value in results.items():
+            if isinstance(value, dict) and "median_ms" in value:
+                flat[(size, key)] = value["median_ms"]
+    return flat
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Выводит медианы замеров"""
+    print(f"\n{'Размер':<8} {'Замер':<22} {'медиана, мс':>12}")
+    for (size, key), median in _flatten(report).items():
+        print(f"{size:<8} {key:<22} {median:>12.1f}")
+    for size, results in report.get("sizes", {}).items():
+        for key, value in results.items():
+            if isinstance(value, dict) and "skipped" in value:
+                print(f"{size:<8} {key:<22} пропущено: {value['skipped']}")
+
+
+def print_comparison(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Сравнивает медианы двух прогонов"""
+    old_flat, new_flat = _flatten(old), _flatten(new)
+    print(
+        f"Было: {old['environment'].get('git_commit')} ({old['environment']['timestamp']}), "
+        f"стало: {new['environment'].get('git_commit')} ({new['environment']['timestamp']})\n"
+    )
+    print(f"{'Размер':<8} {'Замер':<22} {'было, мс':>10} {'стало, мс':>10} {'изменение':>10}")
+    for key in new_flat:
+        if key not in old_flat:
+            continue
+        before, after = old_flat[key], new_flat[key]
+        change = (after - before) / before * 100 if before else 0.0
+        marker = " ⚠️" if change > 10 else ""
+        print(
+            f"{key[0]:<8} {key[1]:<22} {before:>10.1f} {after:>10.1f} {change:>+9.1f}%{marker}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк конвертера md_converter.py")
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        choices=sorted(SIZES),
+        default=["small", "medium", "large"],
+        help="размеры синтетических документов",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="число повторов каждого замера")
+    parser.add_argument(
+        "--pdf", action="store_true", help="замерять и полную конвертацию в PDF (нужен Chromium)"
+    )
+    parser.add_argument(
+        "--kroki-delay", type=float, default=0.0, help="имитируемая задержка онлайн рендеринга, с"
+    )
+    parser.add_argument(
+        "--results-dir", default="bench_results", help="каталог для JSON с результатами"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="RESULT",
+        help="сравнить файлы результатов OLD [NEW] (без NEW - прогнать и сравнить с OLD)",
+    )
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 1:
+        old, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in args.compare[:2])
+        print_comparison(old, new)
+        return
+
+    report = run(args.sizes, args.repeat, args.pdf, args.kroki_delay)
+    results_dir = Path(args.results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    result_file = results_dir / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    result_file.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print_report(report)
+    print(f"\n💾 Результаты: {result_file}")
+
+    if args.compare:
+        old = json.loads(Path(args.compare[0]).read_text(encoding="utf-8"))
+        print()
+        print_comparison(old, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Регрессионные проверки md_converter (запуск: python -m pytest files/md)"""
+
+import os
+import socket
+import threading
+
+import pytest
+
+import md_converter
+from md_converter import convert_markdown_string
+
+FRAGMENT = {"standalone": False, "mermaid_cache": False}
+
+
+def test_indented_fence_keeps_list():
+    markdown = (
+        "1. Install:\n"
+        "\n"
+        "    ```bash\n"
+        "    pip install x\n"
+        "    ```\n"
+        "\n"
+        "    Then run it.\n"
+        "\n"
+        "2. Second step\n"
+    )
+    html = convert_markdown_string(markdown, config=dict(FRAGMENT))
+
+    assert html.count("<ol>") == 1
+    assert "<pre><code>" not in html
+    assert html.index('<div class="highlight">') < html.index("<p>Then run it.</p>")
+    assert html.index("<p>Then run it.</p>") < html.index("</li>")
+
+
+@pytest.fixture
+def service_address():
+    """Сервис конвертации на свободном порту с лимитом тела 100 байт"""
+    from http.server import ThreadingHTTPServer
+
+    service = md_converter.ConversionService(config={"mermaid_cache": False})
+    handler = md_converter._make_service_handler(service, 30.0, max_body=100)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+    service.close(timeout=10)
+
+
+def _post(address, headers: bytes, body: bytes = b"") -> int:
+    """Отправляет POST /convert с заданными заголовками и возвращает код ответа"""
+    with socket.create_connection(address, timeout=10) as connection:
+        connection.sendall(b"POST /convert HTTP/1.1\r\nHost: x\r\n" + headers + b"\r\n" + body)
+        connection.shutdown(socket.SHUT_WR)
+        status_line = connection.makefile("rb").readline()
+    return int(status_line.split()[1])
+
+
+def test_service_requires_content_length(service_address):
+    assert _post(service_address, b"") == 411
+
+
+def test_service_rejects_invalid_content_length(service_address):
+    assert _post(service_address, b"Content-Length: abc\r\n", b"# Hi") == 400
+
+
+def test_service_rejects_negative_content_length(service_address):
+    assert _post(service_address, b"Content-Length: -1\r\n", b"#" * 5000) == 400
+
+
+def test_service_rejects_large_body(service_address):
+    assert _post(service_address, b"Content-Length: 5000\r\n", b"#" * 5000) == 413
+
+
+def test_service_converts(service_address):
+    assert _post(service_address, b"Content-Length: 4\r\n", b"# Hi") == 200
+
+
+def test_disk_cache_hits_and_misses(tmp_path):
+    cache = md_converter.DiskCache(tmp_path)
+    assert cache.get("a" * 64, ".svg") is None
+    path = cache.put_bytes("a" * 64, ".svg", b"<svg/>")
+    assert cache.get("a" * 64, ".svg") == path
+    assert path.read_bytes() == b"<svg/>"
+    assert cache.stats == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_disk_cache_evicts_oldest_to_low_water(tmp_path):
+    cache = md_converter.DiskCache(tmp_path, max_bytes=1000)
+    paths = []
+    for index in range(10):
+        paths.append(cache.put_bytes(f"{index:02d}" + "0" * 62, ".bin", b"x" * 100))
+        # Разное время доступа, чтобы порядок вытеснения был определён
+        os.utime(paths[-1], (index, index))
+    scans = 0
+    original_entries = cache._entries
+
+    def counting_entries():
+        nonlocal scans
+        scans += 1
+        return original_entries()
+
+    cache._entries = counting_entries
+    newest = cache.put_bytes("ff" + "0" * 62, ".bin", b"x" * 100)
+
+    assert newest.exists()
+    assert not paths[0].exists() and not paths[1].exists()
+    assert paths[2].exists()
+    assert cache.stats["evictions"] == 2
+    # После вытеснения до 90% следующая запись не сканирует кэш
+    cache.put_bytes("fe" + "0" * 62, ".bin", b"x" * 50)
+    assert scans == 1
+
+
+def test_disk_cache_skips_entries_larger_than_limit(tmp_path):
+    cache = md_converter.DiskCache(tmp_path, max_bytes=100)
+    assert cache.put_bytes("a" * 64, ".bin", b"x" * 101) is None
+    assert cache.stats["evictions"] == 0
+
+
+def test_parallel_highlight_matches_serial():
+    languages = ["python", "javascript", "bash", "sql", None]
+    markdown = "\n".join(
+        f"## Block {index}\n\n```{languages[index % len(languages)] or ''}\n"
+        f"def f_{index}(x):\n    return x * {index}  # <tag> & \"quotes\"\n```\n"
+        for index in range(60)
+    )
+    # Кэш подсветки отключён, иначе второй проход взял бы блоки из него
+    base = dict(FRAGMENT, highlight_cache=False)
+    serial = convert_markdown_string(markdown, config=dict(base))
+    parallel = convert_markdown_string(
+        markdown,
+        config=dict(
+            base,
+            parallel_highlight=True,
+            parallel_highlight_threshold=0,
+            highlight_workers=2,
+        ),
+    )
+    assert parallel.encode("utf-8") == serial.encode("utf-8")
+
+
+def test_lexer_cache_is_bounded():
+    for index in range(1000):
+        assert md_converter.get_cached_lexer(f"no-such-language-{index}") is None
+    info = md_converter._lexer_by_name.cache_info()
+    assert info.currsize <= info.maxsize
+    assert md_converter.get_cached_lexer("Python") is md_converter.get_cached_lexer("python")
+
+
+def test_svg_reference_without_viewbox_uses_width_and_height():
+    reference = md_converter.svg_reference('<svg width="120px" height="40"></svg>', "d-svg")
+    assert reference.startswith('<svg viewBox="0 0 120 40" width="120" height="40"')
+    assert 'href="#d-svg"' in reference
+    assert md_converter.svg_reference('<svg width="100%"></svg>', "d-svg") is None
+
+
+def test_unsized_svg_repeat_is_embedded_without_script():
+    converter = md_converter.UniversalMarkdownConverter(
+        config={"embed_images": True, "standalone": True, "mermaid_cache": False}
+    )
+    path = converter._store_diagram(None, ".svg", b'<svg id="m"><g id="n"/></svg>')
+    first, _ = converter._embed_diagram("graph TD; A-->B", path)
+    repeat, is_ref = converter._embed_diagram("graph TD; A-->B", path)
+
+    assert not is_ref
+    assert "data-mermaid-ref" not in repeat
+    assert '<g id="n"/>' in repeat
+    diagram_id = converter.diagram_id("graph TD; A-->B")
+    assert f'id="{diagram_id}-svg"' in first and f'id="{diagram_id}-svg"' not in repeat
+
+
+def _blocks(markdown):
+    return list(md_converter.iter_fenced_blocks(markdown))
+
+
+def test_fence_scanner_tilde_fence():
+    (block,) = _blocks("text\n~~~python\nx = 1\n```\n~~~\nafter\n")
+    assert block.language == "python"
+    assert block.code == "x = 1\n```"
+
+
+def test_fence_scanner_long_backtick_fence():
+    (block,) = _blocks("````md\n```python\nx = 1\n```\n````\n")
+    assert block.language == "md"
+    assert block.code == "```python\nx = 1\n```"
+
+
+@pytest.mark.parametrize(
+    "info, language",
+    [
+        ('python title="example.py"', "python"),
+        ("{.python .numberLines}", "python"),
+        ("python{1,3}", "python"),
+        ("", None),
+    ],
+)
+def test_fence_scanner_info_string_attributes(info, language):
+    (block,) = _blocks(f"```{info}\nx = 1\n```\n")
+    assert block.info == info
+    assert block.language == language
+
+
+def test_fence_scanner_unclosed_fence_is_text():
+    assert _blocks("```python\nx = 1\n") == []
+    # Более короткая строка не закрывает блок
+    assert _blocks("````\nx = 1\n```\n") == []
+
+
+def test_fence_scanner_skips_inline_code():
+    markdown = "```inline``` code\n\n```bash\nls\n```\n"
+    (block,) = _blocks(markdown)
+    assert block.language == "bash"
+    assert block.start == markdown.index("```bash")
+
+
+def test_minify_html_keeps_space_between_inline_elements():
+    html = md_converter.minify_html("<p>Hello <em>world</em>\n<b>again</b></p>\n\n<p>x</p>")
+    assert html == "<p>Hello <em>world</em> <b>again</b></p> <p>x</p>"
+
+
+@pytest.mark.parametrize(
+    "block",
+    [
+        "<pre><code>def f():\n    return  1\n\n</code></pre>",
+        '<textarea name="t">  line one\n\n  line two  </textarea>',
+        "<script>\n  var a  =  '<b>  </b>';\n  // comment\n</script>",
+    ],
+)
+def test_minify_html_preserves_raw_blocks(block):
+    html = md_converter.minify_html(f"<div>\n  <!-- note -->\n  {block}\n</div>")
+    assert block in html
+    assert "note" not in html
+
+
+def test_pdf_sections_print_in_browser_pool(tmp_path, monkeypatch):
+    import io
+
+    pypdf = pytest.importorskip("pypdf")
+    threads = []
+
+    def fake_print(self, html_content, html_file, pdf_options=None):
+        threads.append(threading.current_thread())
+        writer = pypdf.PdfWriter()
+        for _ in range(max(1, html_content.count('class="page"'))):
+            writer.add_blank_page(595, 842)
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def no_engine(*args, **kwargs):
+        raise AssertionError("второй браузер не нужен")
+
+    monkeypatch.setattr(md_converter.UniversalMarkdownConverter, "_print_page", fake_print)
+    monkeypatch.setattr(md_converter.PdfBatchEngine, "__init__", no_engine)
+    source = tmp_path / "doc.md"
+    source.write_text("# One\n\ntext\n\n# Two\n\nmore\n", encoding="utf-8")
+    converter = md_converter.UniversalMarkdownConverter(
+        str(source),
+        output_format=md_converter.OutputFormat.PDF,
+        config={"pdf_sections": True, "pdf_section_chars": 0, "pdf_page_numbers": True},
+    )
+    try:
+        data = converter.convert_to_pdf(return_bytes=True)
+    finally:
+        converter.cleanup()
+
+    assert len(pypdf.PdfReader(io.BytesIO(data)).pages) == 2
+    # Два раздела и страница номеров - в потоке пула браузера
+    assert len(threads) == 3 and threading.current_thread() not in threads
+    assert converter._reference_repeats